@@ -0,0 +1,181 @@
+"""Admission control for engine analysis: cost-weighted rate limits and fair scheduling"""
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Callable, Deque, Dict, Optional, Tuple
+
+from fastapi import HTTPException, Request
+
+from .auth import decode_access_token
+from .metrics import registry, Counter, Gauge
+
+# Hard limits on a single request (enforced by the request schemas)
+MAX_DEPTH = int(os.getenv("ANALYSIS_MAX_DEPTH", "22"))
+MAX_BATCH_POSITIONS = int(os.getenv("ANALYSIS_MAX_BATCH", "300"))
+
+# Token bucket per client, in cost units (positions x depth); by default a full
+# bucket covers the largest request the schemas allow
+BUCKET_CAPACITY = float(os.getenv("ANALYSIS_BUCKET_CAPACITY", str(MAX_BATCH_POSITIONS * MAX_DEPTH)))
+BUCKET_REFILL_PER_SECOND = float(os.getenv("ANALYSIS_BUCKET_REFILL", "30"))
+
+# Engines running at once on this node, and how much work may wait for them
+ANALYSIS_CONCURRENCY = int(os.getenv("ANALYSIS_CONCURRENCY", str(os.cpu_count() or 1)))
+MAX_QUEUED_POSITIONS = int(os.getenv(
+    "ANALYSIS_MAX_QUEUED", str(max(MAX_BATCH_POSITIONS, ANALYSIS_CONCURRENCY * 100))))
+
+ADMISSION_REJECTIONS = registry.register(Counter(
+    "analysis_rejections_total", "Analysis requests rejected with 429", ("reason",)))
+
+
+def analysis_cost(positions: int, depth: int) -> float:
+    """Rough engine cost of a request; used to weight rate limits"""
+    return float(positions * depth)
+
+
+class TokenBucketLimiter:
+    """One token bucket per client key, refilled continuously"""
+
+    def __init__(self, capacity: float, refill_per_second: float, max_clients: int = 100_000):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.max_clients = max_clients
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+        self._lock = threading.Lock()
+
+    def try_consume(self, key: str, cost: float) -> float:
+        """Take `cost` tokens; returns 0 on success or the seconds to wait before retrying"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.get(key, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - last) * self.refill_per_second)
+            if cost > tokens:
+                self._buckets[key] = (tokens, now)
+                if cost > self.capacity:
+                    return math.inf
+                return (cost - tokens) / self.refill_per_second
+            self._buckets[key] = (tokens - cost, now)
+            if len(self._buckets) > self.max_clients:
+                self._prune(now)
+            return 0.0
+
+    def _prune(self, now: float):
+        """Forget clients whose bucket has refilled completely"""
+        full_after = self.capacity / self.refill_per_second
+        for key in [k for k, (_, last) in self._buckets.items() if now - last > full_after]:
+            del self._buckets[key]
+
+
+class FairScheduler:
+    """
+    Limits concurrent engine runs and hands free slots out round-robin per client
+
+    A client with a large batch only gets every Nth slot while others are
+    waiting, so small requests are not stuck behind it.
+    """
+
+    def __init__(self, slots: int):
+        self.slots = slots
+        self.busy = 0
+        self._waiting: "OrderedDict[str, Deque[asyncio.Future]]" = OrderedDict()
+
+    @property
+    def queued(self) -> int:
+        return sum(len(q) for q in self._waiting.values())
+
+    async def acquire(self, client: str):
+        if self.busy < self.slots and not self._waiting:
+            self.busy += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._waiting.setdefault(client, deque()).append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            # The slot was handed over just as we were cancelled; pass it on
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+
+    def release(self):
+        while self._waiting:
+            client, queue = next(iter(self._waiting.items()))
+            future = queue.popleft()
+            if queue:
+                self._waiting.move_to_end(client)
+            else:
+                del self._waiting[client]
+            if not future.done():
+                # Slot passes straight to the next client; busy count is unchanged
+                future.set_result(None)
+                return
+        self.busy -= 1
+
+
+class AdmissionController:
+    def __init__(self, limiter: TokenBucketLimiter, scheduler: FairScheduler, max_queued: int):
+        self.limiter = limiter
+        self.scheduler = scheduler
+        self.max_queued = max_queued
+
+    def client_key(self, request: Request) -> str:
+        """Authenticated users are limited per account, everyone else per IP"""
+        auth = request.headers.get("authorization", "")
+        if auth.lower().startswith("bearer "):
+            username = decode_access_token(auth[7:])
+            if username:
+                return f"user:{username}"
+        host = request.client.host if request.client else "unknown"
+        return f"ip:{host}"
+
+    def admit(self, request: Request, positions: int, depth: int,
+              backlog: Optional[int] = None, max_backlog: Optional[int] = None) -> str:
+        """
+        Reject with 429 (and Retry-After) or return the client key to schedule under
+
+        The backlog defaults to this node's scheduler queue. Work that bypasses
+        the scheduler (the distributed broker) passes its own backlog and limit.
+        """
+        client = self.client_key(request)
+
+        backlog = self.scheduler.queued if backlog is None else backlog
+        max_backlog = self.max_queued if max_backlog is None else max_backlog
+        if backlog + positions > max_backlog:
+            retry = max(1, math.ceil(backlog / self.scheduler.slots))
+            self._reject("overloaded", "Analysis queue is full, try again later", retry)
+
+        wait = self.limiter.try_consume(client, analysis_cost(positions, depth))
+        if wait == math.inf:
+            self._reject("too_expensive", "Request exceeds the analysis budget; use fewer positions or lower depth", None)
+        if wait > 0:
+            self._reject("rate_limited", "Analysis rate limit exceeded", math.ceil(wait))
+        return client
+
+    def _reject(self, reason: str, detail: str, retry_after):
+        ADMISSION_REJECTIONS.inc(1.0, reason)
+        headers = {"Retry-After": str(retry_after)} if retry_after is not None else None
+        raise HTTPException(status_code=429, detail=detail, headers=headers)
+
+    async def run(self, client: str, func: Callable, *args):
+        """Run one blocking engine call in a worker thread once a slot is granted"""
+        await self.scheduler.acquire(client)
+        try:
+            return await asyncio.to_thread(func, *args)
+        finally:
+            self.scheduler.release()
+
+
+admission = AdmissionController(
+    TokenBucketLimiter(BUCKET_CAPACITY, BUCKET_REFILL_PER_SECOND),
+    FairScheduler(ANALYSIS_CONCURRENCY),
+    MAX_QUEUED_POSITIONS,
+)
+
+registry.register(Gauge(
+    "analysis_slots_busy", "Engine slots in use by admitted analysis",
+    callback=lambda: {(): admission.scheduler.busy}))
+registry.register(Gauge(
+    "analysis_queued_positions", "Positions waiting for an engine slot",
+    callback=lambda: {(): admission.scheduler.queued}))
@@ -1,56 +1,113 @@
+"""Stockfish engine discovery and position analysis"""
+import os
+import shutil
+from pathlib import Path
+from typing import List, Optional
+
 import chess
 import chess.engine
-import os
 
-# --- PATH FIX START ---
-# Hum Current Working Directory check karenge
-CURRENT_DIR = os.getcwd() # Ye 'backend' folder hona chahiye
-ENGINE_FOLDER = os.path.join(CURRENT_DIR, "engine")
-
-# File ka naam define karein
-ENGINE_FILE = "stockfish_16.exe.exe" 
-STOCKFISH_PATH = os.path.join(ENGINE_FOLDER, ENGINE_FILE)
-
-# Debugging ke liye print karein (Terminal check karein)
-print(f"🔍 Looking for engine at: {STOCKFISH_PATH}")
-
-if os.path.exists(STOCKFISH_PATH):
-    print("✅ Engine FOUND!")
-else:
-    print("❌ Engine NOT FOUND!")
-    print(f"📂 Files in '{ENGINE_FOLDER}':")
-    try:
-        print(os.listdir(ENGINE_FOLDER)) # Folder ke andar kya hai wo dikhaye
-    except Exception as e:
-        print(f"Folder hi nahi mila: {e}")
-# --- PATH FIX END ---
+from .metrics import EngineTimer, ENGINE_ERRORS
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+# Bundled binary shipped next to the app (stockfish_16.exe on Windows)
+BUNDLED_ENGINE = BACKEND_DIR / ("stockfish_16.exe" if os.name == "nt" else "stockfish_16")
+
+
+class EngineManager:
+    """
+    Finds and validates the Stockfish binary on first use
+
+    Nothing touches the filesystem at import time. The path is resolved from
+    STOCKFISH_PATH, then `stockfish` on PATH, then the bundled binary.
+    """
+
+    def __init__(self, configured_path: Optional[str] = None):
+        self.configured_path = configured_path
+        self._path: Optional[str] = None
+        self.engine_name: Optional[str] = None
+        self.error: Optional[str] = None
+
+    def candidates(self) -> List[str]:
+        paths = []
+        configured = self.configured_path or os.getenv("STOCKFISH_PATH")
+        if configured:
+            paths.append(configured)
+        on_path = shutil.which("stockfish")
+        if on_path:
+            paths.append(on_path)
+        paths.append(str(BUNDLED_ENGINE))
+        return paths
+
+    @property
+    def path(self) -> Optional[str]:
+        """First candidate that exists and is executable (resolved once)"""
+        if self._path is None:
+            for candidate in self.candidates():
+                if os.path.isfile(candidate) and os.access(candidate, os.X_OK):
+                    self._path = candidate
+                    break
+        return self._path
+
+    def validate(self) -> bool:
+        """Start the engine once and complete the UCI handshake"""
+        path = self.path
+        if path is None:
+            self.error = f"No Stockfish binary found (tried: {', '.join(self.candidates())})"
+            return False
+        try:
+            with chess.engine.SimpleEngine.popen_uci(path) as engine:
+                self.engine_name = engine.id.get("name", "unknown")
+        except Exception as e:
+            self.error = f"Engine at {path} failed UCI handshake: {e}"
+            return False
+        self.error = None
+        return True
+
+    def analyze(self, fen: str, depth: int) -> dict:
+        board = chess.Board(fen)
+        path = self.path
+        if path is None:
+            return {"evaluation": 0, "mate": False, "best_move": None, "error": "Stockfish engine not found"}
+
+        try:
+            with EngineTimer() as timer, chess.engine.SimpleEngine.popen_uci(path) as engine:
+                timer.spawned()
+                result = engine.analyse(board, chess.engine.Limit(depth=depth))
+                timer.searched(depth, result)
+
+                score = result["score"].white()
+
+                if score.is_mate():
+                    eval_val = score.mate()
+                    is_mate = True
+                else:
+                    eval_val = score.score()
+                    is_mate = False
+
+                return {
+                    "best_move": result["pv"][0].uci() if "pv" in result else None,
+                    "evaluation": eval_val,
+                    "mate": is_mate
+                }
+        except Exception as e:
+            ENGINE_ERRORS.inc()
+            print(f"Engine Error: {e}")
+            return {"evaluation": 0, "mate": False, "best_move": None, "error": str(e)}
+
+
+engine_manager = EngineManager()
+
 
 def analyze_fen_position(fen: str, depth: int):
-    # ... baki code same rahega ...
-    board = chess.Board(fen)
-    
-    if not os.path.exists(STOCKFISH_PATH):
-        return {"evaluation": 0, "mate": False, "best_move": None, "error": f"Path Error: {STOCKFISH_PATH}"}
-
-    try:
-        # Baki function same...
-        with chess.engine.SimpleEngine.popen_uci(STOCKFISH_PATH) as engine:
-            result = engine.analyse(board, chess.engine.Limit(depth=depth))
-            
-            score = result["score"].white()
-            
-            if score.is_mate():
-                eval_val = score.mate()
-                is_mate = True
-            else:
-                eval_val = score.score()
-                is_mate = False
-
-            return {
-                "best_move": result["pv"][0].uci() if "pv" in result else None,
-                "evaluation": eval_val,
-                "mate": is_mate
-            }
-    except Exception as e:
-        print(f"Engine Error: {e}")
-        return {"evaluation": 0, "mate": False, "best_move": None, "error": str(e)}
\ No newline at end of file
+    return engine_manager.analyze(fen, depth)
+
+
+if __name__ == "__main__":
+    # Preflight check for deploys: python -m app.analysis
+    if engine_manager.validate():
+        print(f"Engine OK: {engine_manager.engine_name} at {engine_manager.path}")
+    else:
+        print(f"Engine check failed: {engine_manager.error}")
+        raise SystemExit(1)
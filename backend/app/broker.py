@@ -0,0 +1,330 @@
+"""Job broker for distributed analysis, backed by the application database"""
+import asyncio
+import json
+import os
+import uuid
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+import chess
+from sqlalchemy import and_, delete, or_, select, update
+from sqlalchemy.exc import IntegrityError
+
+from .database import SessionLocal, AnalysisJob, AnalysisWorker, JobStatus
+from .stats import record_review
+
+# "local" runs Stockfish inside the API process, "distributed" hands positions to workers
+ANALYSIS_MODE = os.getenv("ANALYSIS_MODE", "local")
+
+# A claimed job returns to the queue if its worker stops heartbeating for this long
+LEASE_SECONDS = int(os.getenv("ANALYSIS_LEASE_SECONDS", "30"))
+HEARTBEAT_SECONDS = max(1, LEASE_SECONDS // 3)
+MAX_ATTEMPTS = 3
+
+# Finished batches not tied to a game (ad-hoc /analyze calls) are deleted after this long
+RETENTION_SECONDS = int(os.getenv("ANALYSIS_RETENTION_SECONDS", "3600"))
+
+# Unfinished positions the queue may hold before new analysis is refused with 429
+MAX_PENDING_JOBS = int(os.getenv("ANALYSIS_MAX_PENDING", "3000"))
+
+
+class AnalysisBroker:
+    """
+    Queue of positions shared by the API (producer) and workers (consumers)
+
+    Workers claim jobs with a lease that their heartbeat keeps extending. If a
+    worker dies, its leases run out and the jobs are handed to someone else.
+    """
+
+    def submit(self, fens: List[str], depth: int, game_id: Optional[int] = None) -> str:
+        """Queue a batch of positions; raises ValueError if any FEN is invalid"""
+        for index, fen in enumerate(fens):
+            try:
+                chess.Board(fen)
+            except ValueError as e:
+                raise ValueError(f"Invalid FEN at position {index}: {e}")
+        batch_id = uuid.uuid4().hex
+        db = SessionLocal()
+        try:
+            db.bulk_insert_mappings(AnalysisJob, [
+                {
+                    "batch_id": batch_id,
+                    "game_id": game_id,
+                    "position_index": index,
+                    "fen": fen,
+                    "depth": depth,
+                    "status": JobStatus.PENDING,
+                    "attempts": 0,
+                    "created_at": datetime.utcnow(),
+                }
+                for index, fen in enumerate(fens)
+            ])
+            db.commit()
+        finally:
+            db.close()
+        return batch_id
+
+    def claim(self, worker_id: str, limit: int) -> List[Tuple[int, str, int]]:
+        """Lease up to `limit` jobs to a worker; returns (job_id, fen, depth)"""
+        now = datetime.utcnow()
+        token = uuid.uuid4().hex
+        db = SessionLocal()
+        try:
+            # Jobs whose worker vanished too many times are given up on
+            db.execute(
+                update(AnalysisJob)
+                .where(AnalysisJob.status == JobStatus.RUNNING)
+                .where(AnalysisJob.lease_expires_at < now)
+                .where(AnalysisJob.attempts >= MAX_ATTEMPTS)
+                .values(status=JobStatus.FAILED, completed_at=now,
+                        result=json.dumps({"error": "Worker lost too many times"}))
+            )
+            claimable = or_(
+                AnalysisJob.status == JobStatus.PENDING,
+                and_(AnalysisJob.status == JobStatus.RUNNING, AnalysisJob.lease_expires_at < now),
+            )
+            # Ordering by position index first interleaves concurrent batches, so a
+            # long game review does not hold back everyone queued after it
+            candidates = (
+                db.query(AnalysisJob.id)
+                .filter(claimable)
+                .order_by(AnalysisJob.position_index, AnalysisJob.id)
+                .limit(limit)
+                .subquery()
+            )
+            db.execute(
+                update(AnalysisJob)
+                .where(AnalysisJob.id.in_(select(candidates.c.id)))
+                .where(claimable)
+                .values(
+                    status=JobStatus.RUNNING,
+                    worker_id=worker_id,
+                    claim_token=token,
+                    lease_expires_at=now + timedelta(seconds=LEASE_SECONDS),
+                    attempts=AnalysisJob.attempts + 1,
+                )
+                .execution_options(synchronize_session=False)
+            )
+            db.commit()
+            rows = (
+                db.query(AnalysisJob.id, AnalysisJob.fen, AnalysisJob.depth)
+                .filter(AnalysisJob.claim_token == token)
+                .all()
+            )
+            return [tuple(row) for row in rows]
+        finally:
+            db.close()
+
+    def complete(self, worker_id: str, results: List[Tuple[int, dict]]):
+        """Store results for jobs this worker still holds the lease on"""
+        if not results:
+            return
+        now = datetime.utcnow()
+        db = SessionLocal()
+        try:
+            # Jobs whose lease expired and went to another worker are not ours to finish
+            stored = []
+            for job_id, result in results:
+                updated = db.execute(
+                    update(AnalysisJob)
+                    .where(AnalysisJob.id == job_id)
+                    .where(AnalysisJob.worker_id == worker_id)
+                    .where(AnalysisJob.status == JobStatus.RUNNING)
+                    .values(status=JobStatus.DONE, result=json.dumps(result), completed_at=now)
+                )
+                if updated.rowcount:
+                    stored.append(job_id)
+            db.execute(
+                update(AnalysisWorker)
+                .where(AnalysisWorker.id == worker_id)
+                .values(jobs_completed=AnalysisWorker.jobs_completed + len(stored))
+            )
+            db.commit()
+        finally:
+            db.close()
+        # Separate transaction: a statistics failure must not roll back the results
+        try:
+            self._record_finished_reviews(stored)
+        except Exception as e:
+            print(f"Could not record review statistics: {e}")
+
+    def _record_finished_reviews(self, job_ids: List[int]):
+        """Feed game reviews that just finished into the player statistics"""
+        if not job_ids:
+            return
+        for attempt in range(2):
+            db = SessionLocal()
+            try:
+                self._record_reviews_in(db, job_ids)
+                db.commit()
+                return
+            except IntegrityError:
+                # Another worker created the same aggregate rows first; redo against theirs
+                db.rollback()
+                if attempt:
+                    raise
+            finally:
+                db.close()
+
+    def _record_reviews_in(self, db, job_ids: List[int]):
+        """Record every fully finished game review among `job_ids` (caller commits)"""
+        batches = (
+            db.query(AnalysisJob.batch_id, AnalysisJob.game_id)
+            .filter(AnalysisJob.id.in_(job_ids), AnalysisJob.game_id.isnot(None))
+            .distinct()
+            .all()
+        )
+        for batch_id, game_id in batches:
+            jobs = (
+                db.query(AnalysisJob)
+                .filter(AnalysisJob.batch_id == batch_id)
+                .order_by(AnalysisJob.position_index)
+                .all()
+            )
+            if all(job.status == JobStatus.DONE for job in jobs):
+                record_review(db, game_id, [job.fen for job in jobs], [json.loads(job.result) for job in jobs])
+
+    def purge_finished(self, older_than_seconds: int = RETENTION_SECONDS) -> int:
+        """Delete old batches without a game whose jobs have all finished; returns rows deleted"""
+        cutoff = datetime.utcnow() - timedelta(seconds=older_than_seconds)
+        unfinished = select(AnalysisJob.batch_id).where(
+            AnalysisJob.status.in_([JobStatus.PENDING, JobStatus.RUNNING])
+        )
+        db = SessionLocal()
+        try:
+            deleted = db.execute(
+                delete(AnalysisJob)
+                .where(AnalysisJob.game_id.is_(None))
+                .where(AnalysisJob.status.in_([JobStatus.DONE, JobStatus.FAILED]))
+                .where(AnalysisJob.completed_at < cutoff)
+                .where(AnalysisJob.batch_id.not_in(unfinished))
+            ).rowcount
+            db.commit()
+            return deleted
+        finally:
+            db.close()
+
+    def pending_count(self) -> int:
+        """Positions queued or being analysed right now"""
+        db = SessionLocal()
+        try:
+            return (
+                db.query(AnalysisJob.id)
+                .filter(AnalysisJob.status.in_([JobStatus.PENDING, JobStatus.RUNNING]))
+                .count()
+            )
+        finally:
+            db.close()
+
+    def register_worker(self, worker_id: str, hostname: str, concurrency: int):
+        db = SessionLocal()
+        try:
+            db.merge(AnalysisWorker(
+                id=worker_id, hostname=hostname, concurrency=concurrency,
+                started_at=datetime.utcnow(), last_heartbeat=datetime.utcnow(), jobs_completed=0,
+            ))
+            db.commit()
+        finally:
+            db.close()
+
+    def heartbeat(self, worker_id: str):
+        """Mark the worker alive and extend the leases on everything it is running"""
+        now = datetime.utcnow()
+        db = SessionLocal()
+        try:
+            db.execute(update(AnalysisWorker).where(AnalysisWorker.id == worker_id).values(last_heartbeat=now))
+            db.execute(
+                update(AnalysisJob)
+                .where(AnalysisJob.worker_id == worker_id)
+                .where(AnalysisJob.status == JobStatus.RUNNING)
+                .values(lease_expires_at=now + timedelta(seconds=LEASE_SECONDS))
+            )
+            db.commit()
+        finally:
+            db.close()
+
+    def batch_status(self, batch_id: str) -> Optional[dict]:
+        """Progress and results of a batch, in the order the positions were submitted"""
+        db = SessionLocal()
+        try:
+            jobs = (
+                db.query(AnalysisJob)
+                .filter(AnalysisJob.batch_id == batch_id)
+                .order_by(AnalysisJob.position_index)
+                .all()
+            )
+            if not jobs:
+                return None
+            return _collate(batch_id, jobs)
+        finally:
+            db.close()
+
+    def latest_for_game(self, game_id: int) -> Optional[dict]:
+        db = SessionLocal()
+        try:
+            latest = (
+                db.query(AnalysisJob.batch_id)
+                .filter(AnalysisJob.game_id == game_id)
+                .order_by(AnalysisJob.id.desc())
+                .first()
+            )
+        finally:
+            db.close()
+        return self.batch_status(latest.batch_id) if latest else None
+
+    def workers(self) -> List[dict]:
+        cutoff = datetime.utcnow() - timedelta(seconds=LEASE_SECONDS)
+        db = SessionLocal()
+        try:
+            return [
+                {
+                    "id": w.id,
+                    "hostname": w.hostname,
+                    "concurrency": w.concurrency,
+                    "last_heartbeat": w.last_heartbeat,
+                    "jobs_completed": w.jobs_completed,
+                    "alive": w.last_heartbeat >= cutoff,
+                }
+                for w in db.query(AnalysisWorker).order_by(AnalysisWorker.started_at).all()
+            ]
+        finally:
+            db.close()
+
+    async def wait(self, batch_id: str, timeout: float, poll_interval: float = 0.25,
+                   max_poll_interval: float = 2.0) -> dict:
+        """Poll until every job in the batch has finished (or the timeout passes), backing off between polls"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            status = await asyncio.to_thread(self.batch_status, batch_id)
+            if status is None or status["status"] != "running" or loop.time() >= deadline:
+                return status
+            await asyncio.sleep(poll_interval)
+            poll_interval = min(max_poll_interval, poll_interval * 2)
+
+
+def _collate(batch_id: str, jobs: List[AnalysisJob]) -> dict:
+    results = []
+    completed = failed = 0
+    for job in jobs:
+        if job.status == JobStatus.DONE:
+            completed += 1
+            results.append(json.loads(job.result))
+        elif job.status == JobStatus.FAILED:
+            failed += 1
+            results.append({"evaluation": 0, "mate": False, "best_move": None, **json.loads(job.result or "{}")})
+        else:
+            results.append(None)
+    total = len(jobs)
+    return {
+        "batch_id": batch_id,
+        "game_id": jobs[0].game_id,
+        "total": total,
+        "completed": completed,
+        "failed": failed,
+        "status": "done" if completed + failed == total else "running",
+        "results": results,
+    }
+
+
+broker = AnalysisBroker()
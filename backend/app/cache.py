@@ -0,0 +1,150 @@
+"""Response caching for hot read endpoints (in-process TTL or Redis)"""
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+
+# "memory" (default) or a redis:// URL
+CACHE_URL = os.getenv("CACHE_URL", "memory")
+
+LEADERBOARD_TTL_SECONDS = 60
+DAILY_PUZZLE_TTL_SECONDS = 300
+
+
+class MemoryCacheBackend:
+    """Thread-safe dict with per-key expiry, bounded to max_entries"""
+
+    def __init__(self, max_entries: int = 4096):
+        self.max_entries = max_entries
+        self._data: Dict[str, Tuple[float, bytes]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            return value
+
+    def set(self, key: str, value: bytes, ttl: int):
+        with self._lock:
+            if len(self._data) >= self.max_entries and key not in self._data:
+                self._evict()
+            self._data[key] = (time.monotonic() + ttl, value)
+
+    def delete_prefix(self, prefix: str):
+        with self._lock:
+            for key in [k for k in self._data if k.startswith(prefix)]:
+                del self._data[key]
+
+    def _evict(self):
+        now = time.monotonic()
+        for key in [k for k, (exp, _) in self._data.items() if exp < now]:
+            del self._data[key]
+        # Still full: drop the oldest insertion
+        if len(self._data) >= self.max_entries:
+            del self._data[next(iter(self._data))]
+
+
+class RedisCacheBackend:
+    """Shared cache for multiple workers; needs the optional `redis` package"""
+
+    def __init__(self, url: str, namespace: str = "chess-review:"):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("CACHE_URL points at Redis but the 'redis' package is not installed")
+        self.namespace = namespace
+        self._client = redis.Redis.from_url(url)
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self._client.get(self.namespace + key)
+
+    def set(self, key: str, value: bytes, ttl: int):
+        self._client.set(self.namespace + key, value, ex=ttl)
+
+    def delete_prefix(self, prefix: str):
+        keys = list(self._client.scan_iter(match=f"{self.namespace}{prefix}*"))
+        if keys:
+            self._client.delete(*keys)
+
+
+class ResponseCache:
+    """Caches serialized JSON bodies together with their ETag"""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[Tuple[str, bytes]]:
+        raw = self.backend.get(key)
+        if raw is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        etag, body = raw.split(b"\n", 1)
+        return etag.decode(), body
+
+    def set(self, key: str, body: bytes, ttl: int) -> str:
+        etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        self.backend.set(key, etag.encode() + b"\n" + body, ttl)
+        return etag
+
+    def invalidate(self, prefix: str):
+        self.backend.delete_prefix(prefix)
+
+
+def create_cache(url: str = CACHE_URL) -> ResponseCache:
+    if url.startswith("redis://") or url.startswith("rediss://"):
+        return ResponseCache(RedisCacheBackend(url))
+    return ResponseCache(MemoryCacheBackend())
+
+
+response_cache = create_cache()
+
+
+def cached_json(request: Request, key: str, ttl: int, build: Callable[[], object]) -> Response:
+    """
+    Serve a JSON response from the cache, building and storing it on a miss
+
+    Honours If-None-Match with a 304 so clients can revalidate for free.
+    Exceptions raised by `build` (e.g. 404s) propagate and are not cached.
+    """
+    cached = response_cache.get(key)
+    if cached is None:
+        body = json.dumps(jsonable_encoder(build()), separators=(",", ":")).encode()
+        etag = response_cache.set(key, body, ttl)
+    else:
+        etag, body = cached
+
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={ttl}"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+def invalidate_leaderboards():
+    """Call after ratings or game counts change"""
+    response_cache.invalidate("leaderboard:")
+
+
+def invalidate_puzzles():
+    """
+    Call after puzzles are added or the daily puzzle changes
+
+    Invalidation only reaches other processes through a shared backend. With
+    CACHE_URL=memory, offline scripts (seed_data.py, mine_puzzles.py) clear
+    nothing but their own cache, and the API serves the old entries until
+    DAILY_PUZZLE_TTL_SECONDS passes.
+    """
+    response_cache.invalidate("puzzles:")
@@ -1,6 +1,6 @@
 """Database configuration and models using SQLAlchemy"""
 import os
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, Boolean, Text, ForeignKey, Enum
+from sqlalchemy import create_engine, Column, Integer, String, Float, Date, DateTime, Boolean, Text, ForeignKey, Enum, UniqueConstraint
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 from datetime import datetime
@@ -29,6 +29,7 @@ class GameResult(str, enum.Enum):
     BLACK_WIN = "black_win"
     DRAW = "draw"
     ONGOING = "ongoing"
+    ABORTED = "aborted"  # a side never made its first move; unrated, no result
 
 
 class User(Base):
@@ -146,6 +147,107 @@ class Friendship(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
 
 
+class JobStatus(str, enum.Enum):
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+
+class AnalysisJob(Base):
+    """One position to analyse, claimed by a worker through a lease"""
+    __tablename__ = "analysis_jobs"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    batch_id = Column(String, index=True, nullable=False)
+    game_id = Column(Integer, ForeignKey("games.id"), nullable=True, index=True)
+    position_index = Column(Integer, nullable=False)
+    fen = Column(String, nullable=False)
+    depth = Column(Integer, nullable=False)
+    
+    status = Column(Enum(JobStatus), default=JobStatus.PENDING, index=True)
+    worker_id = Column(String, nullable=True)
+    claim_token = Column(String, nullable=True, index=True)
+    lease_expires_at = Column(DateTime, nullable=True)
+    attempts = Column(Integer, default=0)
+    result = Column(Text, nullable=True)  # JSON-encoded analysis result
+    
+    created_at = Column(DateTime, default=datetime.utcnow)
+    completed_at = Column(DateTime, nullable=True)
+
+
+class AnalysisWorker(Base):
+    __tablename__ = "analysis_workers"
+    
+    id = Column(String, primary_key=True)
+    hostname = Column(String, nullable=False)
+    concurrency = Column(Integer, nullable=False)
+    started_at = Column(DateTime, default=datetime.utcnow)
+    last_heartbeat = Column(DateTime, default=datetime.utcnow)
+    jobs_completed = Column(Integer, default=0)
+
+
+class PlayerStats(Base):
+    """Per user, time control and color results, updated as games finish"""
+    __tablename__ = "player_stats"
+    __table_args__ = (UniqueConstraint("user_id", "time_control", "color"),)
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    time_control = Column(Enum(TimeControl), nullable=False)
+    color = Column(String, nullable=False)  # "white" or "black"
+    
+    games = Column(Integer, default=0)
+    wins = Column(Integer, default=0)
+    losses = Column(Integer, default=0)
+    draws = Column(Integer, default=0)
+    
+    # Sum and count rather than an average so reviews can be added incrementally
+    accuracy_sum = Column(Float, default=0.0)
+    accuracy_count = Column(Integer, default=0)
+
+
+class RatingHistory(Base):
+    """Daily rating buckets (closing, high and low) per user and time control"""
+    __tablename__ = "rating_history"
+    __table_args__ = (UniqueConstraint("user_id", "time_control", "day"),)
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    time_control = Column(Enum(TimeControl), nullable=False)
+    day = Column(Date, nullable=False)
+    
+    rating = Column(Integer, nullable=False)  # Rating after the last game of the day
+    rating_high = Column(Integer, nullable=False)
+    rating_low = Column(Integer, nullable=False)
+    games = Column(Integer, default=0)
+
+
+class OpeningStats(Base):
+    __tablename__ = "opening_stats"
+    __table_args__ = (UniqueConstraint("user_id", "color", "opening"),)
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    color = Column(String, nullable=False)
+    opening = Column(String, nullable=False)  # PGN Opening tag, or the first moves in SAN
+    
+    games = Column(Integer, default=0)
+    wins = Column(Integer, default=0)
+    losses = Column(Integer, default=0)
+    draws = Column(Integer, default=0)
+
+
+class GameAccuracy(Base):
+    """Accuracy from the stored review of a game; kept so a re-review can replace it"""
+    __tablename__ = "game_accuracy"
+    
+    game_id = Column(Integer, ForeignKey("games.id"), primary_key=True)
+    white_accuracy = Column(Float, nullable=False)
+    black_accuracy = Column(Float, nullable=False)
+    reviewed_at = Column(DateTime, default=datetime.utcnow)
+
+
 def get_db():
     """Dependency for FastAPI routes"""
     db = SessionLocal()
@@ -0,0 +1,472 @@
+"""
+Real-time PvP games: in-memory game state with write-behind persistence
+
+Game state is owned by this process, so the API must be served by a single
+process (no `uvicorn --workers N`, no replicas); see the README.
+"""
+import asyncio
+import io
+import time
+from datetime import datetime
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+
+import chess
+import chess.pgn
+from fastapi import WebSocket
+
+from .database import SessionLocal, Game, GameResult, UserProfile
+from .rating import update_ratings, get_k_factor
+from .cache import invalidate_leaderboards
+from .stats import record_game
+
+# How often dirty games are written back to the database
+FLUSH_INTERVAL_SECONDS = 5.0
+
+# Each side must make its first move within this long (or its clock, if shorter),
+# otherwise the game is aborted: no result and no rating change. Making the
+# first move is how the opponent of a challenge accepts it.
+FIRST_MOVE_SECONDS = 60.0
+
+
+class LiveGame:
+    """A game being played right now, held entirely in memory"""
+
+    __slots__ = (
+        "game_id", "white_id", "black_id", "time_control", "is_rated",
+        "increment", "board", "clock", "last_tick", "result",
+        "players", "spectators", "lock", "dirty", "version", "loaded_at", "move_clocks",
+    )
+
+    def __init__(self, game: Game, board: Optional[chess.Board] = None,
+                 move_clocks: Optional[List[Optional[float]]] = None):
+        self.game_id = game.id
+        self.white_id = game.white_player_id
+        self.black_id = game.black_player_id
+        self.time_control = game.time_control
+        self.is_rated = game.is_rated
+        self.increment = float(game.increment_seconds or 0)
+        self.board = board or chess.Board()
+        # Remaining seconds per color; the clock only starts after white's first move
+        self.clock = {chess.WHITE: float(game.time_limit_seconds), chess.BLACK: float(game.time_limit_seconds)}
+        self.last_tick: Optional[float] = None
+        # Mover's remaining time after each move, stored as %clk comments in the PGN
+        self.move_clocks: List[Optional[float]] = list(move_clocks or [])
+        for color, offset in ((chess.WHITE, 0), (chess.BLACK, 1)):
+            known = [c for c in self.move_clocks[offset::2] if c is not None]
+            if known:
+                self.clock[color] = known[-1]
+        if self.board.move_stack:
+            # Resumed after a restart: the side to move's clock restarts now, downtime is not charged
+            self.last_tick = time.monotonic()
+        self.result = GameResult.ONGOING
+        self.players: Dict[int, WebSocket] = {}
+        self.spectators: Set[WebSocket] = set()
+        self.lock = asyncio.Lock()
+        self.dirty = False
+        # Bumped on every change, so a write-behind can tell if it missed something
+        self.version = 0
+        # Start of the wait for white's first move
+        self.loaded_at = time.monotonic()
+
+    @property
+    def is_over(self) -> bool:
+        return self.result != GameResult.ONGOING
+
+    @property
+    def is_started(self) -> bool:
+        """Both sides have made a move; until then the game can only be aborted"""
+        return len(self.board.move_stack) >= 2
+
+    def color_of(self, user_id: int) -> Optional[chess.Color]:
+        if user_id == self.white_id:
+            return chess.WHITE
+        if user_id == self.black_id:
+            return chess.BLACK
+        return None
+
+    def remaining(self, color: chess.Color, now: Optional[float] = None) -> float:
+        """Seconds left for a color, counting the time the side to move is using"""
+        left = self.clock[color]
+        if self.last_tick is not None and color == self.board.turn and not self.is_over:
+            left -= (time.monotonic() if now is None else now) - self.last_tick
+        return max(0.0, left)
+
+    def check_flag(self, now: Optional[float] = None) -> bool:
+        """End the game on time if the side to move has run out"""
+        if self.is_over or self.last_tick is None or not self.is_started:
+            return False
+        if self.remaining(self.board.turn, now) > 0:
+            return False
+        self.clock[self.board.turn] = 0.0
+        self.result = GameResult.BLACK_WIN if self.board.turn == chess.WHITE else GameResult.WHITE_WIN
+        self.changed()
+        return True
+
+    def check_abort(self, now: Optional[float] = None) -> bool:
+        """Abort the game if the side to move is overdue with its first move"""
+        if self.is_over or self.is_started:
+            return False
+        now = time.monotonic() if now is None else now
+        waiting_since = self.loaded_at if self.last_tick is None else self.last_tick
+        if now - waiting_since < min(FIRST_MOVE_SECONDS, self.clock[self.board.turn]):
+            return False
+        return self.abort()
+
+    def abort(self) -> bool:
+        """End a game that has not started without a result; returns False once it has started"""
+        if self.is_over or self.is_started:
+            return False
+        self.result = GameResult.ABORTED
+        self.changed()
+        return True
+
+    def push_move(self, user_id: int, uci: str) -> chess.Move:
+        """Validate and apply a move; raises ValueError if it is not allowed"""
+        if self.is_over:
+            raise ValueError("Game is over")
+        color = self.color_of(user_id)
+        if color is None:
+            raise ValueError("Spectators cannot move")
+        if color != self.board.turn:
+            raise ValueError("Not your turn")
+
+        try:
+            move = chess.Move.from_uci(uci)
+        except ValueError:
+            raise ValueError(f"Malformed move: {uci}")
+        if not self.board.is_legal(move):
+            raise ValueError(f"Illegal move: {uci}")
+
+        now = time.monotonic()
+        if self.last_tick is not None:
+            self.clock[color] -= now - self.last_tick
+            self.clock[color] += self.increment
+        self.last_tick = now
+        self.move_clocks.append(self.clock[color])
+
+        self.board.push(move)
+        self.changed()
+
+        outcome = self.board.outcome(claim_draw=True)
+        if outcome is not None:
+            if outcome.winner is None:
+                self.result = GameResult.DRAW
+            else:
+                self.result = GameResult.WHITE_WIN if outcome.winner == chess.WHITE else GameResult.BLACK_WIN
+        return move
+
+    def resign(self, user_id: int):
+        color = self.color_of(user_id)
+        if color is None or self.is_over:
+            raise ValueError("Cannot resign")
+        if self.abort():
+            # Resigning before both sides have moved just calls the game off
+            return
+        self.result = GameResult.BLACK_WIN if color == chess.WHITE else GameResult.WHITE_WIN
+        self.changed()
+
+    def changed(self):
+        self.version += 1
+        self.dirty = True
+
+    def snapshot(self) -> "GameSnapshot":
+        """
+        What to persist, captured on the event loop
+
+        Only copies the move list; the PGN is built by the writer thread so a
+        flush of thousands of games does not stall the loop.
+        """
+        return GameSnapshot(
+            self, list(self.board.move_stack), list(self.move_clocks), self.result, self.version
+        )
+
+    def state(self) -> dict:
+        now = time.monotonic()
+        return {
+            "type": "state",
+            "game_id": self.game_id,
+            "fen": self.board.fen(),
+            "moves": [m.uci() for m in self.board.move_stack],
+            "white_time": self.remaining(chess.WHITE, now),
+            "black_time": self.remaining(chess.BLACK, now),
+            "result": self.result.value,
+        }
+
+    def watchers(self) -> List[WebSocket]:
+        return list(self.players.values()) + list(self.spectators)
+
+
+class GameSnapshot(NamedTuple):
+    live: LiveGame
+    moves: List[chess.Move]
+    clocks: List[Optional[float]]
+    result: GameResult
+    version: int
+
+    def pgn(self) -> str:
+        game = chess.pgn.Game()
+        node = game
+        for move, clock in zip(self.moves, self.clocks + [None] * (len(self.moves) - len(self.clocks))):
+            node = node.add_variation(move)
+            if clock is not None:
+                node.set_clock(clock)
+        game.headers["Event"] = "Live game"
+        game.headers["Result"] = _RESULT_TAGS[self.result]
+        return str(game)
+
+
+_RESULT_TAGS = {
+    GameResult.WHITE_WIN: "1-0",
+    GameResult.BLACK_WIN: "0-1",
+    GameResult.DRAW: "1/2-1/2",
+    GameResult.ONGOING: "*",
+    GameResult.ABORTED: "*",
+}
+
+
+def board_from_pgn(pgn: Optional[str]) -> Tuple[chess.Board, List[Optional[float]]]:
+    """Rebuild a board and the per-move clocks from a stored PGN (empty PGN means the start position)"""
+    if not pgn:
+        return chess.Board(), []
+    parsed = chess.pgn.read_game(io.StringIO(pgn))
+    if parsed is None:
+        return chess.Board(), []
+    clocks = [node.clock() for node in parsed.mainline()]
+    return parsed.end().board(), clocks
+
+
+class LiveGameManager:
+    """Owns every active game on this node and persists them in the background"""
+
+    def __init__(self, flush_interval: float = FLUSH_INTERVAL_SECONDS):
+        self.games: Dict[int, LiveGame] = {}
+        self.flush_interval = flush_interval
+        # Finished games whose final write failed; flush() retries them
+        self.unwritten: Set[int] = set()
+        self._flush_task: Optional[asyncio.Task] = None
+
+    def get_or_load(self, game_id: int) -> Optional[LiveGame]:
+        """Return the in-memory game, loading it from the database on first access"""
+        live = self.games.get(game_id)
+        if live is not None:
+            return live
+
+        db = SessionLocal()
+        try:
+            game = db.query(Game).filter(Game.id == game_id).first()
+            if game is None or game.result != GameResult.ONGOING or game.is_vs_engine:
+                return None
+            live = LiveGame(game, *board_from_pgn(game.pgn))
+        finally:
+            db.close()
+
+        # Another coroutine may have loaded it meanwhile; keep the first one
+        return self.games.setdefault(game_id, live)
+
+    def load_ongoing(self) -> int:
+        """Load every unfinished PvP game at startup, so abandoned ones still get aborted or flagged"""
+        db = SessionLocal()
+        try:
+            games = (
+                db.query(Game)
+                .filter(Game.result == GameResult.ONGOING, Game.is_vs_engine.isnot(True))
+                .all()
+            )
+            for game in games:
+                self.games.setdefault(game.id, LiveGame(game, *board_from_pgn(game.pgn)))
+            return len(games)
+        finally:
+            db.close()
+
+    def register(self, game: Game) -> LiveGame:
+        live = LiveGame(game)
+        self.games[game.id] = live
+        return live
+
+    async def broadcast(self, live: LiveGame, message: dict):
+        """Send a message to both players and all spectators concurrently"""
+        sockets = live.watchers()
+        if not sockets:
+            return
+        results = await asyncio.gather(
+            *(ws.send_json(message) for ws in sockets), return_exceptions=True
+        )
+        for ws, outcome in zip(sockets, results):
+            if isinstance(outcome, Exception):
+                self.disconnect(live, ws)
+
+    def disconnect(self, live: LiveGame, ws: WebSocket):
+        live.spectators.discard(ws)
+        for user_id, sock in list(live.players.items()):
+            if sock is ws:
+                del live.players[user_id]
+
+    async def handle_message(self, live: LiveGame, user_id: int, ws: WebSocket, message: dict):
+        """Apply a single client message and fan out the result"""
+        kind = message.get("type")
+        async with live.lock:
+            try:
+                if live.check_flag() or live.check_abort():
+                    # Flagged or aborted before this message arrived; nothing else to apply
+                    kind = None
+                elif kind == "move":
+                    move = live.push_move(user_id, str(message.get("move", "")))
+                    await self.broadcast(live, {
+                        "type": "move",
+                        "move": move.uci(),
+                        "fen": live.board.fen(),
+                        "white_time": live.remaining(chess.WHITE),
+                        "black_time": live.remaining(chess.BLACK),
+                    })
+                elif kind == "resign":
+                    live.resign(user_id)
+                elif kind == "state":
+                    await ws.send_json(live.state())
+                    return
+                else:
+                    raise ValueError(f"Unknown message type: {kind}")
+            except ValueError as e:
+                await ws.send_json({"type": "error", "detail": str(e)})
+                return
+
+            if live.is_over:
+                await self.finish(live)
+
+    async def finish(self, live: LiveGame):
+        """
+        Persist a completed game immediately and drop it from memory (caller holds live.lock)
+
+        If the write fails the game stays loaded and is retried on every flush
+        until its result and ratings are stored.
+        """
+        retry = live.game_id in self.unwritten
+        try:
+            await self._persist([live.snapshot()])
+        except Exception as e:
+            print(f"Could not store finished game {live.game_id}, will retry: {e}")
+            self.unwritten.add(live.game_id)
+        else:
+            self.unwritten.discard(live.game_id)
+            self.games.pop(live.game_id, None)
+        if not retry:
+            await self.broadcast(live, {"type": "game_over", "result": live.result.value})
+
+    async def _persist(self, snapshots: List[GameSnapshot]):
+        """Write snapshots in a thread, then clear dirty on games that have not moved on since"""
+        await asyncio.to_thread(self._write_games, snapshots)
+        for snap in snapshots:
+            if snap.live.version == snap.version:
+                snap.live.dirty = False
+
+    def _write_games(self, snapshots: List[GameSnapshot]):
+        """Write the PGN (and final result, if any) of the given snapshots in one transaction"""
+        db = SessionLocal()
+        completed = False
+        try:
+            ids = [snap.live.game_id for snap in snapshots]
+            rows = {g.id: g for g in db.query(Game).filter(Game.id.in_(ids)).all()}
+            for snap in snapshots:
+                game = rows.get(snap.live.game_id)
+                if game is None:
+                    continue
+                game.pgn = snap.pgn()
+                if snap.result == GameResult.ABORTED and game.result == GameResult.ONGOING:
+                    game.result = snap.result
+                    game.completed_at = datetime.utcnow()
+                elif snap.result != GameResult.ONGOING and game.result == GameResult.ONGOING:
+                    game.result = snap.result
+                    game.completed_at = datetime.utcnow()
+                    _apply_ratings(db, game, snap.result)
+                    record_game(db, game)
+                    completed = True
+            db.commit()
+        finally:
+            db.close()
+        if completed:
+            invalidate_leaderboards()
+
+    async def flush(self):
+        """Write back every game whose moves have not been persisted yet"""
+        now = time.monotonic()
+        finished = [
+            g for g in self.games.values()
+            # is_over also catches games ended outside a message (abort(), failed writes)
+            if g.check_flag(now) or g.check_abort(now) or g.is_over
+        ]
+        snapshots = []
+        for live in [g for g in self.games.values() if g.dirty and not g.is_over]:
+            async with live.lock:
+                snapshots.append(live.snapshot())
+        if snapshots:
+            await self._persist(snapshots)
+        for live in finished:
+            async with live.lock:
+                # handle_message may have finished it while we waited for the lock
+                if live.game_id in self.games:
+                    await self.finish(live)
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Live game flush error: {e}")
+
+    def start(self):
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        """Stop the background writer and persist whatever is still pending"""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        snapshots = []
+        for live in [g for g in self.games.values() if g.dirty]:
+            async with live.lock:
+                snapshots.append(live.snapshot())
+        if snapshots:
+            await self._persist(snapshots)
+
+
+def _apply_ratings(db, game: Game, result: GameResult):
+    """Update both players' profile stats and ratings for a finished game"""
+    white = db.query(UserProfile).filter(UserProfile.user_id == game.white_player_id).first()
+    black = db.query(UserProfile).filter(UserProfile.user_id == game.black_player_id).first()
+    if white is None or black is None:
+        return
+
+    if game.is_rated:
+        rating_field = f"rating_{game.time_control.value}"
+        white_before = getattr(white, rating_field)
+        black_before = getattr(black, rating_field)
+        # K depends on the games played before this one, so rate before counting it
+        k_factor = get_k_factor(white_before, white.total_games or 0)
+        white_after, _ = update_ratings(white_before, black_before, result.value, k_factor)
+        k_factor = get_k_factor(black_before, black.total_games or 0)
+        _, black_after = update_ratings(white_before, black_before, result.value, k_factor)
+
+        game.white_rating_before, game.white_rating_after = white_before, white_after
+        game.black_rating_before, game.black_rating_after = black_before, black_after
+        setattr(white, rating_field, white_after)
+        setattr(black, rating_field, black_after)
+
+    for profile, won, lost in (
+        (white, result == GameResult.WHITE_WIN, result == GameResult.BLACK_WIN),
+        (black, result == GameResult.BLACK_WIN, result == GameResult.WHITE_WIN),
+    ):
+        profile.total_games = (profile.total_games or 0) + 1
+        if won:
+            profile.wins = (profile.wins or 0) + 1
+        elif lost:
+            profile.losses = (profile.losses or 0) + 1
+        else:
+            profile.draws = (profile.draws or 0) + 1
+
+
+live_games = LiveGameManager()
@@ -1,14 +1,20 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, status, WebSocket, WebSocketDisconnect
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from typing import List, Optional
+from datetime import date, datetime, timedelta
 from sqlalchemy.orm import Session
-from datetime import timedelta
+import asyncio
+import time
 from contextlib import asynccontextmanager
 
-from .analysis import analyze_fen_position
-from .database import get_db, init_db, User, UserProfile, Game, Puzzle, PuzzleAttempt
+from .analysis import analyze_fen_position, engine_manager
+from .admission import admission, MAX_DEPTH, MAX_BATCH_POSITIONS
+from .broker import broker, ANALYSIS_MODE, MAX_PENDING_JOBS
+from .database import engine as db_engine, get_db, init_db, SessionLocal, User, UserProfile, Game, Puzzle, PuzzleAttempt, TimeControl
+from .stats import player_stats, rating_history
 from .auth import (
     verify_password, get_password_hash, create_access_token,
     decode_access_token, ACCESS_TOKEN_EXPIRE_MINUTES, Token
@@ -16,18 +22,32 @@ from .auth import (
 from .schemas import (
     UserCreate, UserLogin, UserResponse, UserProfileResponse, UserProfileUpdate,
     GameCreate, GameResponse, PuzzleResponse, PuzzleAttemptCreate,
-    PuzzleAttemptResponse, LeaderboardEntry, LeaderboardResponse
+    PuzzleAttemptResponse, LeaderboardEntry, LeaderboardResponse,
+    MatchmakingRequest, MatchmakingStatus, MatchmakingPoolStats,
+    PlayerStatsResponse, RatingHistoryPoint
 )
 from .rating import update_ratings, get_k_factor
+from .live import live_games
+from .matchmaking import matchmaker
+from .metrics import registry, metrics_middleware, instrument_database, Gauge, PASSWORD_VERIFY_SECONDS
+from .cache import cached_json, response_cache, LEADERBOARD_TTL_SECONDS, DAILY_PUZZLE_TTL_SECONDS
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Startup: Initialize database
+    # Startup: Initialize database, check the engine once, start the live game writer
     init_db()
+    if await asyncio.to_thread(engine_manager.validate):
+        print(f"Engine ready: {engine_manager.engine_name} at {engine_manager.path}")
+    else:
+        print(f"Engine unavailable, analysis will return errors: {engine_manager.error}")
+    await asyncio.to_thread(live_games.load_ongoing)
+    live_games.start()
+    matchmaker.start()
     yield
-    # Shutdown: cleanup if needed
-    pass
+    # Shutdown: persist any moves not yet written back
+    await matchmaker.stop()
+    await live_games.stop()
 
 
 app = FastAPI(title="Chess Review API", lifespan=lifespan)
@@ -39,18 +59,33 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+app.middleware("http")(metrics_middleware)
+instrument_database(db_engine)
+
+# Cache and matchmaking gauges, read from their owners at scrape time
+registry.register(Gauge(
+    "response_cache_requests", "Response cache lookups by outcome", ("outcome",),
+    callback=lambda: {("hit",): response_cache.hits, ("miss",): response_cache.misses}))
+registry.register(Gauge(
+    "response_cache_hit_ratio", "Fraction of response cache lookups served from cache",
+    callback=lambda: {(): response_cache.hits / max(1, response_cache.hits + response_cache.misses)}))
+registry.register(Gauge(
+    "matchmaking_queue_depth", "Players waiting per time control", ("time_control",),
+    callback=lambda: {(tc.value,): len(pool) for tc, pool in matchmaker.pools.items()}))
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+oauth2_scheme_optional = OAuth2PasswordBearer(tokenUrl="token", auto_error=False)
 
 
 class AnalysisRequest(BaseModel):
     fen: str
-    depth: int = 12
+    depth: int = Field(12, ge=1, le=MAX_DEPTH)
 
 
 # --- BATCH SUPPORT ---
 class BatchAnalysisRequest(BaseModel):
-    fens: List[str]
-    depth: int = 10
+    fens: List[str] = Field(..., max_length=MAX_BATCH_POSITIONS)
+    depth: int = Field(10, ge=1, le=MAX_DEPTH)
 
 
 class AnalysisResponse(BaseModel):
@@ -60,6 +95,36 @@ class AnalysisResponse(BaseModel):
     error: Optional[str] = None
 
 
+# --- DISTRIBUTED ANALYSIS ---
+class AnalysisJobCreate(BaseModel):
+    fens: List[str] = Field(..., max_length=MAX_BATCH_POSITIONS)
+    depth: int = Field(10, ge=1, le=MAX_DEPTH)
+    game_id: Optional[int] = None
+
+
+class AnalysisBatchStatus(BaseModel):
+    batch_id: str
+    game_id: Optional[int] = None
+    total: int
+    completed: int
+    failed: int
+    status: str  # "running" or "done"
+    results: List[Optional[AnalysisResponse]]
+
+
+class AnalysisWorkerResponse(BaseModel):
+    id: str
+    hostname: str
+    concurrency: int
+    last_heartbeat: datetime
+    jobs_completed: int
+    alive: bool
+
+
+# How long /analyze and /analyze-batch wait for workers in distributed mode
+DISTRIBUTED_WAIT_SECONDS = 120
+
+
 # --- HELPER FUNCTIONS ---
 async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
     """Get current authenticated user"""
@@ -76,6 +141,15 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
     return user
 
 
+async def get_optional_user(
+    token: Optional[str] = Depends(oauth2_scheme_optional), db: Session = Depends(get_db)
+) -> Optional[User]:
+    """The authenticated user, or None for anonymous requests"""
+    if token is None:
+        return None
+    return await get_current_user(token, db)
+
+
 # --- AUTHENTICATION ENDPOINTS ---
 @app.post("/register", response_model=UserResponse)
 def register(user_data: UserCreate, db: Session = Depends(get_db)):
@@ -108,7 +182,12 @@ def register(user_data: UserCreate, db: Session = Depends(get_db)):
 def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
     """Login and get access token"""
     user = db.query(User).filter(User.username == form_data.username).first()
-    if not user or not verify_password(form_data.password, user.hashed_password):
+    password_ok = False
+    if user:
+        start = time.perf_counter()
+        password_ok = verify_password(form_data.password, user.hashed_password)
+        PASSWORD_VERIFY_SECONDS.observe(time.perf_counter() - start)
+    if not password_ok:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
@@ -157,6 +236,25 @@ async def update_user_profile(
     return profile
 
 
+@app.get("/users/{user_id}/stats", response_model=PlayerStatsResponse)
+async def get_user_stats(user_id: int, db: Session = Depends(get_db)):
+    """Per time control and color records, average accuracy and top openings"""
+    if not db.query(User.id).filter(User.id == user_id).first():
+        raise HTTPException(status_code=404, detail="User not found")
+    return player_stats(db, user_id)
+
+
+@app.get("/users/{user_id}/rating-history/{time_control}", response_model=List[RatingHistoryPoint])
+async def get_rating_history(
+    user_id: int,
+    time_control: TimeControl,
+    db: Session = Depends(get_db),
+    days: int = Query(365, ge=1, le=3650)
+):
+    """Daily rating buckets from the last `days` days, oldest first"""
+    return rating_history(db, user_id, time_control, days=days)
+
+
 # --- GAME ENDPOINTS ---
 @app.get("/games/my-games", response_model=List[GameResponse])
 async def get_my_games(
@@ -172,10 +270,132 @@ async def get_my_games(
     return games
 
 
+@app.post("/games", response_model=GameResponse)
+async def create_game(
+    game_data: GameCreate,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Create a live PvP game against another user (creator plays white)"""
+    if game_data.opponent_id is None or game_data.opponent_id == current_user.id:
+        raise HTTPException(status_code=400, detail="A different opponent is required")
+    if not db.query(User).filter(User.id == game_data.opponent_id).first():
+        raise HTTPException(status_code=404, detail="Opponent not found")
+
+    game = Game(
+        white_player_id=current_user.id,
+        black_player_id=game_data.opponent_id,
+        time_control=game_data.time_control,
+        time_limit_seconds=game_data.time_limit_seconds,
+        increment_seconds=game_data.increment_seconds,
+        is_rated=game_data.is_rated,
+    )
+    db.add(game)
+    db.commit()
+    db.refresh(game)
+
+    live_games.register(game)
+    return game
+
+
+@app.websocket("/ws/games/{game_id}")
+async def game_socket(websocket: WebSocket, game_id: int, token: Optional[str] = None):
+    """Play or spectate a live game; players authenticate with ?token=<jwt>"""
+    user_id = None
+    if token:
+        username = decode_access_token(token)
+        db = SessionLocal()
+        try:
+            user = db.query(User).filter(User.username == username).first() if username else None
+        finally:
+            db.close()
+        if user is None:
+            await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+            return
+        user_id = user.id
+
+    live = live_games.get_or_load(game_id)
+    if live is None:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    await websocket.accept()
+    if user_id is not None and live.color_of(user_id) is not None:
+        live.players[user_id] = websocket
+        matchmaker.picked_up(user_id, game_id)
+    else:
+        live.spectators.add(websocket)
+    await websocket.send_json(live.state())
+
+    try:
+        while True:
+            try:
+                message = await websocket.receive_json()
+            except (ValueError, KeyError):
+                # Not JSON, or a binary frame
+                message = None
+            if not isinstance(message, dict):
+                await websocket.send_json({"type": "error", "detail": "Messages must be JSON objects"})
+                continue
+            await live_games.handle_message(live, user_id, websocket, message)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        live_games.disconnect(live, websocket)
+
+
+# --- MATCHMAKING ENDPOINTS ---
+def _matchmaking_status(user_id: int) -> MatchmakingStatus:
+    game_id = matchmaker.match_for(user_id)
+    if game_id is not None:
+        return MatchmakingStatus(status="matched", game_id=game_id)
+    time_control = matchmaker.queued_in(user_id)
+    if time_control is not None:
+        return MatchmakingStatus(status="queued", time_control=time_control)
+    return MatchmakingStatus(status="idle")
+
+
+@app.post("/matchmaking/queue", response_model=MatchmakingStatus)
+async def join_matchmaking(
+    request: MatchmakingRequest,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Queue for a rated game in the given time control"""
+    profile = db.query(UserProfile).filter(UserProfile.user_id == current_user.id).first()
+    if not profile:
+        raise HTTPException(status_code=404, detail="Profile not found")
+
+    rating = getattr(profile, f"rating_{request.time_control.value}")
+    await matchmaker.join(current_user.id, request.time_control, rating)
+    return _matchmaking_status(current_user.id)
+
+
+@app.get("/matchmaking/status", response_model=MatchmakingStatus)
+async def get_matchmaking_status(current_user: User = Depends(get_current_user)):
+    """Poll whether the current user has been paired yet"""
+    return _matchmaking_status(current_user.id)
+
+
+@app.delete("/matchmaking/queue", response_model=MatchmakingStatus)
+async def leave_matchmaking(current_user: User = Depends(get_current_user)):
+    """Leave the matchmaking queue"""
+    matchmaker.leave(current_user.id)
+    matchmaker.matched.pop(current_user.id, None)
+    return _matchmaking_status(current_user.id)
+
+
+@app.get("/matchmaking/stats", response_model=List[MatchmakingPoolStats])
+async def get_matchmaking_stats():
+    """Queue depth and time-to-match for every pool"""
+    return matchmaker.stats()
+
+
 # --- LEADERBOARD ENDPOINTS ---
 @app.get("/leaderboard/{time_control}", response_model=LeaderboardResponse)
 async def get_leaderboard(
     time_control: str,
+    request: Request,
     db: Session = Depends(get_db),
     page: int = 1,
     per_page: int = 50
@@ -188,51 +408,58 @@ async def get_leaderboard(
     if not hasattr(UserProfile, rating_field):
         raise HTTPException(status_code=400, detail="Invalid time control")
     
-    profiles = db.query(UserProfile, User).join(User).order_by(
-        getattr(UserProfile, rating_field).desc()
-    ).offset(offset).limit(per_page).all()
-    
-    entries = [
-        LeaderboardEntry(
-            username=user.username,
-            rating=getattr(profile, rating_field),
-            total_games=profile.total_games,
-            wins=profile.wins,
-            losses=profile.losses,
-            draws=profile.draws
+    def build():
+        profiles = db.query(UserProfile, User).join(User).order_by(
+            getattr(UserProfile, rating_field).desc()
+        ).offset(offset).limit(per_page).all()
+        
+        entries = [
+            LeaderboardEntry(
+                username=user.username,
+                rating=getattr(profile, rating_field),
+                total_games=profile.total_games,
+                wins=profile.wins,
+                losses=profile.losses,
+                draws=profile.draws
+            )
+            for profile, user in profiles
+        ]
+        
+        total_count = db.query(UserProfile).count()
+        
+        return LeaderboardResponse(
+            entries=entries,
+            total_count=total_count,
+            page=page,
+            per_page=per_page
         )
-        for profile, user in profiles
-    ]
     
-    total_count = db.query(UserProfile).count()
-    
-    return LeaderboardResponse(
-        entries=entries,
-        total_count=total_count,
-        page=page,
-        per_page=per_page
-    )
+    key = f"leaderboard:{time_control}:{page}:{per_page}"
+    return cached_json(request, key, LEADERBOARD_TTL_SECONDS, build)
 
 
 # --- PUZZLE ENDPOINTS ---
 @app.get("/puzzles/daily", response_model=PuzzleResponse)
-async def get_daily_puzzle(db: Session = Depends(get_db)):
+async def get_daily_puzzle(request: Request, db: Session = Depends(get_db)):
     """Get today's daily puzzle"""
-    from datetime import date
     today = date.today()
-    puzzle = db.query(Puzzle).filter(
-        Puzzle.is_daily == True,
-        Puzzle.daily_date == today
-    ).first()
-    
-    if not puzzle:
-        # If no daily puzzle, get a random one
-        puzzle = db.query(Puzzle).order_by(Puzzle.id).first()
-    
-    if not puzzle:
-        raise HTTPException(status_code=404, detail="No puzzles available")
-    
-    return puzzle
+
+    def build():
+        puzzle = db.query(Puzzle).filter(
+            Puzzle.is_daily == True,
+            Puzzle.daily_date == today
+        ).first()
+        
+        if not puzzle:
+            # If no daily puzzle, get a random one
+            puzzle = db.query(Puzzle).order_by(Puzzle.id).first()
+        
+        if not puzzle:
+            raise HTTPException(status_code=404, detail="No puzzles available")
+        
+        return PuzzleResponse.model_validate(puzzle)
+
+    return cached_json(request, f"puzzles:daily:{today.isoformat()}", DAILY_PUZZLE_TTL_SECONDS, build)
 
 
 @app.post("/puzzles/attempt", response_model=PuzzleAttemptResponse)
@@ -260,16 +487,104 @@ def read_root():
     return {"message": "Chess Review API is running"}
 
 
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Prometheus text exposition of request, database, engine and cache metrics"""
+    return registry.render()
+
+
+async def _admit_to_broker(http_request: Request, positions: int, depth: int) -> str:
+    """Admission for work handed to the workers, bounded by the broker's unfinished jobs"""
+    backlog = await asyncio.to_thread(broker.pending_count)
+    return admission.admit(http_request, positions, depth, backlog, MAX_PENDING_JOBS)
+
+
+async def _submit_to_broker(fens: List[str], depth: int, game_id: Optional[int] = None) -> str:
+    try:
+        return await asyncio.to_thread(broker.submit, fens, depth, game_id)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+
+async def _analyze_distributed(fens: List[str], depth: int) -> List[dict]:
+    """Hand positions to the worker pool and wait for all of them"""
+    batch_id = await _submit_to_broker(fens, depth)
+    batch = await broker.wait(batch_id, DISTRIBUTED_WAIT_SECONDS)
+    if batch["status"] != "done":
+        raise HTTPException(
+            status_code=504,
+            detail=f"Analysis still running; poll /analysis/jobs/{batch_id}",
+        )
+    return batch["results"]
+
+
 @app.post("/analyze", response_model=AnalysisResponse)
-def analyze(request: AnalysisRequest):
-    data = analyze_fen_position(request.fen, request.depth)
-    return data
+async def analyze(request: AnalysisRequest, http_request: Request):
+    if ANALYSIS_MODE == "distributed":
+        await _admit_to_broker(http_request, 1, request.depth)
+        return (await _analyze_distributed([request.fen], request.depth))[0]
+    client = admission.admit(http_request, 1, request.depth)
+    return await admission.run(client, analyze_fen_position, request.fen, request.depth)
 
 
 @app.post("/analyze-batch", response_model=List[AnalysisResponse])
-def analyze_batch(request: BatchAnalysisRequest):
-    results = []
-    for fen in request.fens:
-        data = analyze_fen_position(fen, request.depth)
-        results.append(data)
-    return results
+async def analyze_batch(request: BatchAnalysisRequest, http_request: Request):
+    if ANALYSIS_MODE == "distributed":
+        await _admit_to_broker(http_request, len(request.fens), request.depth)
+        return await _analyze_distributed(request.fens, request.depth)
+    client = admission.admit(http_request, len(request.fens), request.depth)
+    # Each position takes its own engine slot so other users interleave fairly
+    return await asyncio.gather(*(
+        admission.run(client, analyze_fen_position, fen, request.depth)
+        for fen in request.fens
+    ))
+
+
+@app.post("/analysis/jobs", response_model=AnalysisBatchStatus)
+async def submit_analysis_job(
+    request: AnalysisJobCreate,
+    http_request: Request,
+    db: Session = Depends(get_db),
+    current_user: Optional[User] = Depends(get_optional_user)
+):
+    """Queue positions for the worker pool and return immediately"""
+    if request.game_id is not None:
+        # A game review feeds both players' accuracy, so only they may submit one
+        game = db.query(Game).filter(Game.id == request.game_id).first()
+        if game is None:
+            raise HTTPException(status_code=404, detail="Game not found")
+        if current_user is None:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Log in to review a stored game",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+        if current_user.id not in (game.white_player_id, game.black_player_id):
+            raise HTTPException(status_code=403, detail="Only the players can review this game")
+    await _admit_to_broker(http_request, len(request.fens), request.depth)
+    batch_id = await _submit_to_broker(request.fens, request.depth, request.game_id)
+    return await asyncio.to_thread(broker.batch_status, batch_id)
+
+
+@app.get("/analysis/jobs/{batch_id}", response_model=AnalysisBatchStatus)
+async def get_analysis_job(batch_id: str):
+    """Progress and collated results of a queued analysis"""
+    batch = await asyncio.to_thread(broker.batch_status, batch_id)
+    if batch is None:
+        raise HTTPException(status_code=404, detail="Analysis job not found")
+    return batch
+
+
+@app.get("/games/{game_id}/analysis", response_model=AnalysisBatchStatus)
+async def get_game_analysis(game_id: int):
+    """Most recent queued analysis of a stored game"""
+    batch = await asyncio.to_thread(broker.latest_for_game, game_id)
+    if batch is None:
+        raise HTTPException(status_code=404, detail="No analysis for this game")
+    return batch
+
+
+@app.get("/analysis/workers", response_model=List[AnalysisWorkerResponse])
+async def list_analysis_workers():
+    """Registered workers and whether their heartbeat is current"""
+    return await asyncio.to_thread(broker.workers)
@@ -0,0 +1,267 @@
+"""
+Matchmaking queues that pair players by rating, widening the window over time
+
+Queues live in this process's memory, like live games; serve the API from a
+single process so every player joins the same queues.
+"""
+import asyncio
+import random
+import time
+from typing import Dict, List, Optional, Tuple
+
+from sortedcontainers import SortedList
+
+from .database import SessionLocal, Game, TimeControl
+from .live import live_games
+
+# Rating window: starts narrow and widens the longer a player waits
+BASE_WINDOW = 50
+WINDOW_GROWTH_PER_SECOND = 10
+MAX_WINDOW = 500
+
+# How often the background sweep tries to pair waiting players
+SWEEP_INTERVAL_SECONDS = 1.0
+
+# Clock settings used for games created by matchmaking (seconds, increment)
+DEFAULT_CLOCKS = {
+    TimeControl.BULLET: (60, 0),
+    TimeControl.BLITZ: (300, 0),
+    TimeControl.RAPID: (600, 0),
+    TimeControl.CLASSICAL: (1800, 0),
+}
+
+# A match not picked up (by connecting to the game) within this long is dropped and its game aborted
+MATCH_PICKUP_SECONDS = 120
+
+# (rating, enqueued_at, user_id) -- kept sorted so neighbours are closest in rating
+QueueEntry = Tuple[int, float, int]
+
+
+def rating_window(waited_seconds: float) -> float:
+    """Maximum rating difference a player accepts after waiting this long"""
+    return min(MAX_WINDOW, BASE_WINDOW + WINDOW_GROWTH_PER_SECOND * waited_seconds)
+
+
+class MatchmakingPool:
+    """Players waiting for a game in one time control, sorted by rating"""
+
+    def __init__(self, time_control: TimeControl):
+        self.time_control = time_control
+        # Balanced sorted container: O(log n) insert, delete and positional lookup
+        self._entries: SortedList = SortedList()
+        self._by_user: Dict[int, QueueEntry] = {}
+        self.matches = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._by_user
+
+    def enqueue(self, user_id: int, rating: int, now: Optional[float] = None):
+        if user_id in self._by_user:
+            return
+        entry = (rating, time.monotonic() if now is None else now, user_id)
+        self._entries.add(entry)
+        self._by_user[user_id] = entry
+
+    def remove(self, user_id: int) -> bool:
+        entry = self._by_user.pop(user_id, None)
+        if entry is None:
+            return False
+        self._entries.remove(entry)
+        return True
+
+    def _best_neighbour(self, index: int, now: float) -> Optional[int]:
+        """Index of the closest-rated neighbour both players would accept"""
+        rating, since, _ = self._entries[index]
+        best, best_diff = None, None
+        for other in (index - 1, index + 1):
+            if other < 0 or other >= len(self._entries):
+                continue
+            other_rating, other_since, _ = self._entries[other]
+            diff = abs(rating - other_rating)
+            # The longer-waiting player's window decides, so nobody waits forever
+            window = rating_window(now - min(since, other_since))
+            if diff <= window and (best_diff is None or diff < best_diff):
+                best, best_diff = other, diff
+        return best
+
+    def _pop_pair(self, a: int, b: int, now: float) -> Tuple[int, int]:
+        first, second = self._entries[a], self._entries[b]
+        for entry in (first, second):
+            waited = now - entry[1]
+            self.total_wait_seconds += waited
+            self.max_wait_seconds = max(self.max_wait_seconds, waited)
+        self.matches += 1
+        self.remove(first[2])
+        self.remove(second[2])
+        return first[2], second[2]
+
+    def match_user(self, user_id: int, now: Optional[float] = None) -> Optional[Tuple[int, int]]:
+        """Try to pair a single queued user with their closest acceptable neighbour"""
+        entry = self._by_user.get(user_id)
+        if entry is None:
+            return None
+        now = time.monotonic() if now is None else now
+        index = self._entries.bisect_left(entry)
+        other = self._best_neighbour(index, now)
+        if other is None:
+            return None
+        return self._pop_pair(index, other, now)
+
+    def sweep(self, now: Optional[float] = None) -> List[Tuple[int, int]]:
+        """Pair as many waiting players as possible, longest-waiting first"""
+        now = time.monotonic() if now is None else now
+        pairs = []
+        for _, _, user_id in sorted(self._entries, key=lambda e: e[1]):
+            if user_id not in self._by_user:
+                continue
+            pair = self.match_user(user_id, now)
+            if pair is not None:
+                pairs.append(pair)
+        return pairs
+
+    def stats(self, now: Optional[float] = None) -> dict:
+        now = time.monotonic() if now is None else now
+        oldest = min((e[1] for e in self._entries), default=None)
+        return {
+            "time_control": self.time_control.value,
+            "queue_depth": len(self._entries),
+            "longest_wait_seconds": (now - oldest) if oldest is not None else 0.0,
+            "matches": self.matches,
+            "avg_time_to_match_seconds": (
+                self.total_wait_seconds / (2 * self.matches) if self.matches else 0.0
+            ),
+            "max_time_to_match_seconds": self.max_wait_seconds,
+        }
+
+
+class Matchmaker:
+    """One pool per time control, plus the games created for matched players"""
+
+    def __init__(self, sweep_interval: float = SWEEP_INTERVAL_SECONDS):
+        self.pools = {tc: MatchmakingPool(tc) for tc in TimeControl}
+        self.sweep_interval = sweep_interval
+        # user_id -> (game_id, matched_at), held until the player picks it up
+        self.matched: Dict[int, Tuple[int, float]] = {}
+        self._sweep_task: Optional[asyncio.Task] = None
+
+    def queued_in(self, user_id: int) -> Optional[TimeControl]:
+        for tc, pool in self.pools.items():
+            if user_id in pool:
+                return tc
+        return None
+
+    async def join(self, user_id: int, time_control: TimeControl, rating: int):
+        """Queue a player (leaving any other pool) and try to pair them right away"""
+        self.leave(user_id)
+        self.matched.pop(user_id, None)
+        pool = self.pools[time_control]
+        pool.enqueue(user_id, rating)
+        pair = pool.match_user(user_id)
+        if pair is not None:
+            await self._create_games(time_control, [pair])
+
+    def leave(self, user_id: int) -> bool:
+        return any(pool.remove(user_id) for pool in self.pools.values())
+
+    def match_for(self, user_id: int, now: Optional[float] = None) -> Optional[int]:
+        """Game the player was paired into, unless it has finished or was never picked up"""
+        entry = self.matched.get(user_id)
+        if entry is None:
+            return None
+        game_id, matched_at = entry
+        now = time.monotonic() if now is None else now
+        live = live_games.games.get(game_id)
+        if live is None:
+            del self.matched[user_id]
+            return None
+        if now - matched_at > MATCH_PICKUP_SECONDS:
+            # The player never connected; call the game off so the opponent cannot flag them.
+            # abort() is a no-op once both sides have moved. The flush loop stores the result.
+            live.abort()
+            del self.matched[user_id]
+            return None
+        return game_id
+
+    def picked_up(self, user_id: int, game_id: int):
+        """The player connected to their matched game; stop reporting it"""
+        entry = self.matched.get(user_id)
+        if entry is not None and entry[0] == game_id:
+            del self.matched[user_id]
+
+    def expire_matches(self, now: Optional[float] = None):
+        now = time.monotonic() if now is None else now
+        for user_id in list(self.matched):
+            self.match_for(user_id, now)
+
+    async def sweep(self):
+        self.expire_matches()
+        for tc, pool in self.pools.items():
+            pairs = pool.sweep()
+            if pairs:
+                await self._create_games(tc, pairs)
+
+    async def _create_games(self, time_control: TimeControl, pairs: List[Tuple[int, int]]):
+        games = await asyncio.to_thread(_insert_games, time_control, pairs)
+        now = time.monotonic()
+        for game in games:
+            live_games.register(game)
+            self.matched[game.white_player_id] = (game.id, now)
+            self.matched[game.black_player_id] = (game.id, now)
+
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                await self.sweep()
+            except Exception as e:
+                print(f"Matchmaking sweep error: {e}")
+
+    def start(self):
+        if self._sweep_task is None:
+            self._sweep_task = asyncio.create_task(self._sweep_loop())
+
+    async def stop(self):
+        if self._sweep_task is not None:
+            self._sweep_task.cancel()
+            try:
+                await self._sweep_task
+            except asyncio.CancelledError:
+                pass
+            self._sweep_task = None
+
+    def stats(self) -> List[dict]:
+        now = time.monotonic()
+        return [pool.stats(now) for pool in self.pools.values()]
+
+
+def _insert_games(time_control: TimeControl, pairs: List[Tuple[int, int]]) -> List[Game]:
+    """Create one game per matched pair in a single transaction, with random colors"""
+    time_limit, increment = DEFAULT_CLOCKS[time_control]
+    db = SessionLocal()
+    try:
+        games = []
+        for a, b in pairs:
+            white, black = (a, b) if random.random() < 0.5 else (b, a)
+            games.append(Game(
+                white_player_id=white,
+                black_player_id=black,
+                time_control=time_control,
+                time_limit_seconds=time_limit,
+                increment_seconds=increment,
+            ))
+        db.add_all(games)
+        db.commit()
+        for game in games:
+            db.refresh(game)
+        db.expunge_all()
+        return games
+    finally:
+        db.close()
+
+
+matchmaker = Matchmaker()
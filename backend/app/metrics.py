@@ -0,0 +1,281 @@
+"""
+Prometheus-style metrics: counters, gauges and histograms with text exposition
+
+This module imports nothing from the app, so the engine code, workers and
+offline scripts can use it without pulling in the database, cache or live
+game state. Gauges for those components are registered by main.py.
+"""
+import bisect
+import os
+import threading
+import time
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import event
+
+# Per-request profiling via the X-Profile header; off unless explicitly enabled
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "").lower() in ("1", "true", "yes")
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_labels(names: Sequence[str], values: LabelValues, extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, *labels: str):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        with self._lock:
+            for labels, value in self._values.items():
+                lines.append(f"{self.name}{_format_labels(self.label_names, labels)} {value}")
+        return lines
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = (),
+                 callback: Optional[Callable[[], Dict[LabelValues, float]]] = None):
+        super().__init__(name, help_text, labels)
+        self._values: Dict[LabelValues, float] = {}
+        # Evaluated at scrape time, for values owned by other components
+        self._callback = callback
+
+    def set(self, value: float, *labels: str):
+        with self._lock:
+            self._values[labels] = value
+
+    def inc(self, amount: float = 1.0, *labels: str):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, *labels: str):
+        self.inc(-amount, *labels)
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        with self._lock:
+            values = dict(self._values)
+        if self._callback is not None:
+            values.update(self._callback())
+        for labels, value in values.items():
+            lines.append(f"{self.name}{_format_labels(self.label_names, labels)} {value}")
+        return lines
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> (per-bucket counts incl. +Inf, sum, count)
+        self._values: Dict[LabelValues, Tuple[List[int], float, int]] = {}
+
+    def observe(self, value: float, *labels: str):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total, count = self._values.get(labels) or ([0] * (len(self.buckets) + 1), 0.0, 0)
+            counts[index] += 1
+            self._values[labels] = (counts, total + value, count + 1)
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        with self._lock:
+            items = [(labels, list(counts), total, count) for labels, (counts, total, count) in self._values.items()]
+        for labels, counts, total, count in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound!r}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, labels)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, labels)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# --- HTTP ---
+REQUEST_LATENCY = registry.register(Histogram(
+    "http_request_duration_seconds", "Request latency by route", ("method", "route", "status")))
+REQUESTS_IN_PROGRESS = registry.register(Gauge(
+    "http_requests_in_progress", "Requests currently being handled"))
+
+# --- Database ---
+DB_QUERIES_PER_REQUEST = registry.register(Histogram(
+    "db_queries_per_request", "SQL statements executed per request", ("route",),
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100)))
+DB_QUERY_DURATION = registry.register(Histogram(
+    "db_query_duration_seconds", "SQL statement execution time",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)))
+
+# --- Engine ---
+ENGINE_BUSY = registry.register(Gauge(
+    "engine_busy", "Stockfish processes currently analysing"))
+ENGINE_CAPACITY = registry.register(Gauge(
+    "engine_capacity", "Engine processes this node can run at once (CPU cores)"))
+ENGINE_CAPACITY.set(os.cpu_count() or 1)
+ENGINE_SPAWN_SECONDS = registry.register(Histogram(
+    "engine_spawn_seconds", "Time to start Stockfish and complete the UCI handshake"))
+ENGINE_SEARCH_SECONDS = registry.register(Histogram(
+    "engine_search_seconds", "Time spent searching one position", ("depth",)))
+ENGINE_ERRORS = registry.register(Counter(
+    "engine_errors_total", "Analyses that failed because of the engine"))
+ENGINE_NPS = registry.register(Histogram(
+    "engine_nodes_per_second", "Search speed reported by the engine",
+    buckets=(1e5, 2.5e5, 5e5, 1e6, 2.5e6, 5e6, 1e7, 2.5e7)))
+
+# --- Auth ---
+PASSWORD_VERIFY_SECONDS = registry.register(Histogram(
+    "password_verify_seconds", "bcrypt verification time in /token",
+    buckets=(0.01, 0.05, 0.1, 0.2, 0.3, 0.5, 1.0, 2.0)))
+
+
+
+# Mutable per-request state; the object is shared with threadpool copies of the context
+class _RequestStats:
+    __slots__ = ("db_queries",)
+
+    def __init__(self):
+        self.db_queries = 0
+
+
+_request_stats: ContextVar[Optional[_RequestStats]] = ContextVar("request_stats", default=None)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.db_queries += 1
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get("query_start")
+    if starts:
+        DB_QUERY_DURATION.observe(time.perf_counter() - starts.pop())
+
+
+def instrument_database(db_engine):
+    """Count and time SQL statements executed on a SQLAlchemy engine"""
+    event.listen(db_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(db_engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def _route_template(request) -> str:
+    """Use the matched route path (/games/{id}) rather than the raw URL to bound cardinality"""
+    route = request.scope.get("route")
+    return getattr(route, "path", "unmatched")
+
+
+async def metrics_middleware(request, call_next):
+    """Record latency and DB query count for every HTTP request"""
+    if PROFILING_ENABLED and request.headers.get("x-profile", "").lower() in ("1", "true"):
+        return await _profile_request(request, call_next)
+
+    stats = _RequestStats()
+    token = _request_stats.set(stats)
+    REQUESTS_IN_PROGRESS.inc()
+    start = time.perf_counter()
+    status_code = "500"
+    try:
+        response = await call_next(request)
+        status_code = str(response.status_code)
+        return response
+    finally:
+        elapsed = time.perf_counter() - start
+        REQUESTS_IN_PROGRESS.dec()
+        _request_stats.reset(token)
+        route = _route_template(request)
+        REQUEST_LATENCY.observe(elapsed, request.method, route, status_code)
+        DB_QUERIES_PER_REQUEST.observe(stats.db_queries, route)
+
+
+async def _profile_request(request, call_next):
+    """Run the request under pyinstrument and return the profile instead of the body"""
+    from fastapi.responses import HTMLResponse, PlainTextResponse
+    try:
+        from pyinstrument import Profiler
+    except ImportError:
+        return PlainTextResponse("pyinstrument is not installed", status_code=501)
+
+    profiler = Profiler(async_mode="enabled")
+    profiler.start()
+    await call_next(request)
+    profiler.stop()
+    return HTMLResponse(profiler.output_html())
+
+
+class EngineTimer:
+    """Tracks one analysis: spawn and search durations plus engine busy count"""
+
+    def __enter__(self):
+        ENGINE_BUSY.inc()
+        self._mark = time.perf_counter()
+        return self
+
+    def spawned(self):
+        now = time.perf_counter()
+        ENGINE_SPAWN_SECONDS.observe(now - self._mark)
+        self._mark = now
+
+    def searched(self, depth: int, info: dict):
+        ENGINE_SEARCH_SECONDS.observe(time.perf_counter() - self._mark, str(depth))
+        nps = info.get("nps")
+        if nps:
+            ENGINE_NPS.observe(float(nps))
+
+    def __exit__(self, *exc):
+        ENGINE_BUSY.dec()
+        return False
@@ -1,7 +1,7 @@
 """Pydantic schemas for API requests and responses"""
 from pydantic import BaseModel, EmailStr
-from typing import Optional, List
-from datetime import datetime
+from typing import Optional, List, Dict
+from datetime import date, datetime
 from app.database import TimeControl, GameResult
 
 
@@ -139,3 +139,67 @@ class LeaderboardResponse(BaseModel):
     total_count: int
     page: int
     per_page: int
+
+
+# Matchmaking Schemas
+class MatchmakingRequest(BaseModel):
+    time_control: TimeControl
+
+
+class MatchmakingStatus(BaseModel):
+    status: str  # "idle", "queued" or "matched"
+    time_control: Optional[TimeControl] = None
+    game_id: Optional[int] = None
+
+
+class MatchmakingPoolStats(BaseModel):
+    time_control: TimeControl
+    queue_depth: int
+    longest_wait_seconds: float
+    matches: int
+    avg_time_to_match_seconds: float
+    max_time_to_match_seconds: float
+
+
+# Player Statistics Schemas
+class StatsRecord(BaseModel):
+    games: int
+    wins: int
+    losses: int
+    draws: int
+    score: Optional[float]
+    average_accuracy: Optional[float]
+
+
+class TimeControlStats(BaseModel):
+    overall: StatsRecord
+    white: StatsRecord
+    black: StatsRecord
+
+
+class OpeningStatsEntry(BaseModel):
+    opening: str
+    color: str
+    games: int
+    wins: int
+    losses: int
+    draws: int
+
+
+class PlayerStatsResponse(BaseModel):
+    user_id: int
+    overall: StatsRecord
+    by_color: Dict[str, StatsRecord]
+    by_time_control: Dict[str, TimeControlStats]
+    openings: List[OpeningStatsEntry]
+
+
+class RatingHistoryPoint(BaseModel):
+    day: date
+    rating: int
+    rating_high: int
+    rating_low: int
+    games: int
+    
+    class Config:
+        from_attributes = True
@@ -0,0 +1,290 @@
+"""Incrementally maintained player statistics: records, rating history, openings, accuracy"""
+import io
+import math
+from datetime import date, datetime, timedelta
+from typing import List, Optional
+
+import chess
+import chess.pgn
+from sqlalchemy.orm import Session
+
+from .database import (
+    Game, GameResult, TimeControl, PlayerStats, RatingHistory, OpeningStats, GameAccuracy
+)
+
+# Plies used to name an opening when the PGN has no Opening tag
+OPENING_PLIES = 6
+MATE_CP = 10000
+
+
+def _get_or_create(db: Session, model, **keys):
+    row = db.query(model).filter_by(**keys).first()
+    if row is None:
+        row = model(**keys)
+        for column in model.__table__.columns:
+            if column.default is not None and getattr(row, column.name) is None and not callable(column.default.arg):
+                setattr(row, column.name, column.default.arg)
+        db.add(row)
+        # The session does not autoflush; make the row visible to the next lookup
+        db.flush()
+    return row
+
+
+def _score(result: GameResult, color: str) -> str:
+    if result == GameResult.DRAW:
+        return "draws"
+    won = (result == GameResult.WHITE_WIN) == (color == "white")
+    return "wins" if won else "losses"
+
+
+def opening_name(pgn: Optional[str]) -> Optional[str]:
+    if not pgn:
+        return None
+    parsed = chess.pgn.read_game(io.StringIO(pgn))
+    if parsed is None:
+        return None
+    if parsed.headers.get("Opening"):
+        return parsed.headers["Opening"]
+    board = parsed.board()
+    sans = []
+    for move in parsed.mainline_moves():
+        if len(sans) == OPENING_PLIES:
+            break
+        sans.append(board.san(move))
+        board.push(move)
+    return " ".join(sans) or None
+
+
+def record_game(db: Session, game: Game):
+    """
+    Fold a finished game into both players' aggregates
+
+    Call once per game, inside the transaction that sets its result. The
+    caller commits.
+    """
+    if game.result in (GameResult.ONGOING, GameResult.ABORTED):
+        return
+    day = (game.completed_at or datetime.utcnow()).date()
+    opening = opening_name(game.pgn)
+
+    for color, user_id, rating_after in (
+        ("white", game.white_player_id, game.white_rating_after),
+        ("black", game.black_player_id, game.black_rating_after),
+    ):
+        outcome = _score(game.result, color)
+
+        stats = _get_or_create(db, PlayerStats, user_id=user_id, time_control=game.time_control, color=color)
+        stats.games += 1
+        setattr(stats, outcome, getattr(stats, outcome) + 1)
+
+        if opening:
+            op = _get_or_create(db, OpeningStats, user_id=user_id, color=color, opening=opening)
+            op.games += 1
+            setattr(op, outcome, getattr(op, outcome) + 1)
+
+        if game.is_rated and rating_after is not None:
+            bucket = db.query(RatingHistory).filter_by(
+                user_id=user_id, time_control=game.time_control, day=day
+            ).first()
+            if bucket is None:
+                db.add(RatingHistory(
+                    user_id=user_id, time_control=game.time_control, day=day,
+                    rating=rating_after, rating_high=rating_after, rating_low=rating_after, games=1,
+                ))
+                db.flush()
+            else:
+                bucket.rating = rating_after
+                bucket.rating_high = max(bucket.rating_high, rating_after)
+                bucket.rating_low = min(bucket.rating_low, rating_after)
+                bucket.games += 1
+
+
+def _win_percent(cp: float) -> float:
+    return 50 + 50 * (2 / (1 + math.exp(-0.00368208 * cp)) - 1)
+
+
+def game_accuracy(fens: List[str], results: List[dict]) -> Optional[dict]:
+    """
+    Per-color accuracy (0-100) from consecutive position evaluations
+
+    Evaluations are in centipawns from white's point of view, as returned by
+    the analysis endpoints. Uses the win-percentage loss of each move.
+    """
+    if len(fens) < 2 or len(fens) != len(results) or any(r is None or r.get("error") for r in results):
+        return None
+
+    win = []
+    for fen, result in zip(fens, results):
+        cp = result["evaluation"]
+        if result.get("mate"):
+            if cp == 0:
+                # Mate on the board is reported as 0 either way; the side to move is the one mated
+                cp = -MATE_CP if fen.split()[1] == "w" else MATE_CP
+            else:
+                cp = MATE_CP if cp > 0 else -MATE_CP
+        win.append(_win_percent(cp))
+
+    per_move = {"white": [], "black": []}
+    for i in range(len(fens) - 1):
+        white_to_move = fens[i].split()[1] == "w"
+        before, after = (win[i], win[i + 1]) if white_to_move else (100 - win[i], 100 - win[i + 1])
+        loss = max(0.0, before - after)
+        accuracy = 103.1668 * math.exp(-0.04354 * loss) - 3.1669
+        per_move["white" if white_to_move else "black"].append(max(0.0, min(100.0, accuracy)))
+
+    if not per_move["white"] or not per_move["black"]:
+        return None
+    return {color: sum(moves) / len(moves) for color, moves in per_move.items()}
+
+
+def _position_key(fen: str) -> str:
+    # Placement, side to move and castling; clients disagree on en passant and move counters
+    return " ".join(fen.split()[:3])
+
+
+def is_review_of(pgn: Optional[str], fens: List[str]) -> bool:
+    """True if `fens` are exactly the positions of the stored game, start to finish"""
+    if not pgn:
+        return False
+    parsed = chess.pgn.read_game(io.StringIO(pgn))
+    if parsed is None:
+        return False
+    board = parsed.board()
+    positions = [board.fen()]
+    for move in parsed.mainline_moves():
+        board.push(move)
+        positions.append(board.fen())
+    return len(positions) == len(fens) and all(
+        _position_key(a) == _position_key(b) for a, b in zip(positions, fens)
+    )
+
+
+def record_review(db: Session, game_id: int, fens: List[str], results: List[dict]):
+    """Store the accuracy of a reviewed game and add it to both players' aggregates"""
+    game = db.query(Game).filter(Game.id == game_id).first()
+    # Only a review of the game's own positions may touch its players' accuracy
+    if game is None or not is_review_of(game.pgn, fens):
+        return
+    accuracy = game_accuracy(fens, results)
+    if accuracy is None:
+        return
+
+    previous = db.query(GameAccuracy).filter(GameAccuracy.game_id == game_id).first()
+    for color, user_id in (("white", game.white_player_id), ("black", game.black_player_id)):
+        stats = _get_or_create(db, PlayerStats, user_id=user_id, time_control=game.time_control, color=color)
+        if previous is not None:
+            # A re-review replaces the old figure instead of counting the game twice
+            stats.accuracy_sum -= getattr(previous, f"{color}_accuracy")
+            stats.accuracy_count -= 1
+        stats.accuracy_sum += accuracy[color]
+        stats.accuracy_count += 1
+
+    if previous is None:
+        db.add(GameAccuracy(game_id=game_id, white_accuracy=accuracy["white"], black_accuracy=accuracy["black"]))
+    else:
+        previous.white_accuracy = accuracy["white"]
+        previous.black_accuracy = accuracy["black"]
+        previous.reviewed_at = datetime.utcnow()
+
+
+def player_stats(db: Session, user_id: int, top_openings: int = 10) -> dict:
+    """Everything the profile page needs, from the precomputed tables (two queries)"""
+    rows = db.query(PlayerStats).filter(PlayerStats.user_id == user_id).all()
+    openings = (
+        db.query(OpeningStats)
+        .filter(OpeningStats.user_id == user_id)
+        .order_by(OpeningStats.games.desc())
+        .limit(top_openings)
+        .all()
+    )
+
+    def record(items):
+        games = sum(r.games for r in items)
+        wins = sum(r.wins for r in items)
+        draws = sum(r.draws for r in items)
+        accuracy_count = sum(r.accuracy_count for r in items)
+        return {
+            "games": games,
+            "wins": wins,
+            "losses": sum(r.losses for r in items),
+            "draws": draws,
+            "score": (wins + 0.5 * draws) / games if games else None,
+            "average_accuracy": (
+                sum(r.accuracy_sum for r in items) / accuracy_count if accuracy_count else None
+            ),
+        }
+
+    return {
+        "user_id": user_id,
+        "overall": record(rows),
+        "by_color": {color: record([r for r in rows if r.color == color]) for color in ("white", "black")},
+        "by_time_control": {
+            tc.value: {
+                "overall": record([r for r in rows if r.time_control == tc]),
+                "white": record([r for r in rows if r.time_control == tc and r.color == "white"]),
+                "black": record([r for r in rows if r.time_control == tc and r.color == "black"]),
+            }
+            for tc in TimeControl
+        },
+        "openings": [
+            {"opening": o.opening, "color": o.color, "games": o.games,
+             "wins": o.wins, "losses": o.losses, "draws": o.draws}
+            for o in openings
+        ],
+    }
+
+
+def rating_history(db: Session, user_id: int, time_control: TimeControl, days: int = 365) -> List[RatingHistory]:
+    """Daily buckets from the last `days` days, oldest first (days without games have no bucket)"""
+    since = date.today() - timedelta(days=days)
+    return (
+        db.query(RatingHistory)
+        .filter(
+            RatingHistory.user_id == user_id,
+            RatingHistory.time_control == time_control,
+            RatingHistory.day >= since,
+        )
+        .order_by(RatingHistory.day)
+        .all()
+    )
+
+
+def rebuild_all(db: Session):
+    """Recompute game-derived aggregates from scratch (for games finished before this existed)"""
+    for model in (PlayerStats, RatingHistory, OpeningStats):
+        db.query(model).delete()
+    db.flush()
+    ids = [
+        game_id for (game_id,) in db.query(Game.id)
+        .filter(Game.result.notin_([GameResult.ONGOING, GameResult.ABORTED]))
+        .order_by(Game.completed_at, Game.id)
+    ]
+    for start in range(0, len(ids), 500):
+        chunk = ids[start:start + 500]
+        games = {g.id: g for g in db.query(Game).filter(Game.id.in_(chunk))}
+        for game_id in chunk:
+            record_game(db, games[game_id])
+        db.flush()
+        db.expunge_all()
+    # Accuracy from earlier reviews lives in game_accuracy; fold it back in
+    for acc in db.query(GameAccuracy).all():
+        game = db.query(Game).filter(Game.id == acc.game_id).first()
+        if game is None:
+            continue
+        for color, user_id in (("white", game.white_player_id), ("black", game.black_player_id)):
+            stats = _get_or_create(db, PlayerStats, user_id=user_id, time_control=game.time_control, color=color)
+            stats.accuracy_sum += getattr(acc, f"{color}_accuracy")
+            stats.accuracy_count += 1
+    db.commit()
+
+
+if __name__ == "__main__":
+    from .database import SessionLocal, init_db
+
+    init_db()
+    session = SessionLocal()
+    try:
+        rebuild_all(session)
+    finally:
+        session.close()
+    print("Player statistics rebuilt successfully!")
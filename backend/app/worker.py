@@ -0,0 +1,86 @@
+"""Standalone analysis worker: pulls positions from the broker and runs Stockfish
+
+Run one per host with `python -m app.worker` and point DATABASE_URL at the
+same database as the API.
+"""
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from .analysis import engine_manager
+from .broker import broker, HEARTBEAT_SECONDS
+from .database import init_db
+
+IDLE_POLL_SECONDS = 0.5
+# Back-off ceiling after broker errors (database locked, connection lost, ...)
+MAX_BACKOFF_SECONDS = 30.0
+# How often each worker deletes expired ad-hoc batches
+PURGE_INTERVAL_SECONDS = 300
+
+
+class AnalysisWorker:
+    def __init__(self, concurrency: int):
+        self.id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.concurrency = concurrency
+        self._stop = threading.Event()
+
+    def _heartbeat_loop(self):
+        while not self._stop.wait(HEARTBEAT_SECONDS):
+            try:
+                broker.heartbeat(self.id)
+            except Exception as e:
+                print(f"Heartbeat failed: {e}")
+
+    def _analyze(self, job):
+        job_id, fen, depth = job
+        # A bad job must not take down the rest of the claimed batch (or the worker)
+        try:
+            return job_id, engine_manager.analyze(fen, depth)
+        except Exception as e:
+            return job_id, {"evaluation": 0, "mate": False, "best_move": None, "error": str(e)}
+
+    def run(self):
+        broker.register_worker(self.id, socket.gethostname(), self.concurrency)
+        threading.Thread(target=self._heartbeat_loop, daemon=True).start()
+        print(f"Worker {self.id} started with {self.concurrency} engine slots")
+
+        next_purge = time.monotonic()
+        failures = 0
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            while not self._stop.is_set():
+                try:
+                    if time.monotonic() >= next_purge:
+                        broker.purge_finished()
+                        next_purge = time.monotonic() + PURGE_INTERVAL_SECONDS
+                    jobs = broker.claim(self.id, self.concurrency)
+                    if not jobs:
+                        failures = 0
+                        time.sleep(IDLE_POLL_SECONDS)
+                        continue
+                    broker.complete(self.id, list(pool.map(self._analyze, jobs)))
+                    failures = 0
+                except Exception as e:
+                    # Jobs whose results were lost go back to the queue when their lease runs out
+                    failures += 1
+                    delay = min(MAX_BACKOFF_SECONDS, IDLE_POLL_SECONDS * 2 ** failures)
+                    print(f"Broker error, retrying in {delay:.1f}s: {e}")
+                    self._stop.wait(delay)
+
+    def stop(self):
+        self._stop.set()
+
+
+if __name__ == "__main__":
+    init_db()
+    if not engine_manager.validate():
+        print(f"Engine check failed: {engine_manager.error}")
+        raise SystemExit(1)
+
+    worker = AnalysisWorker(int(os.getenv("WORKER_CONCURRENCY", str(os.cpu_count() or 1))))
+    try:
+        worker.run()
+    except KeyboardInterrupt:
+        worker.stop()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""Minimal UCI engine for load tests
+
+Speaks enough UCI for python-chess, evaluates by material and answers with
+the first legal move. It sleeps FAKE_ENGINE_MS_PER_DEPTH milliseconds per
+requested ply, so search cost still scales with depth without needing
+Stockfish. Point the backend at it with:
+
+    STOCKFISH_PATH=loadtest/fake_uci_engine.py
+"""
+import os
+import sys
+import time
+
+import chess
+
+MS_PER_DEPTH = float(os.getenv("FAKE_ENGINE_MS_PER_DEPTH", "5"))
+PIECE_VALUES = {chess.PAWN: 100, chess.KNIGHT: 300, chess.BISHOP: 300, chess.ROOK: 500, chess.QUEEN: 900, chess.KING: 0}
+
+
+def evaluate(board: chess.Board) -> int:
+    """Material balance from the side to move's point of view"""
+    score = 0
+    for piece in board.piece_map().values():
+        value = PIECE_VALUES[piece.piece_type]
+        score += value if piece.color == board.turn else -value
+    return score
+
+
+def parse_position(tokens):
+    if tokens[0] == "startpos":
+        board, rest = chess.Board(), tokens[1:]
+    else:
+        board, rest = chess.Board(" ".join(tokens[1:7])), tokens[7:]
+    if rest and rest[0] == "moves":
+        for uci in rest[1:]:
+            board.push_uci(uci)
+    return board
+
+
+def go(board: chess.Board, tokens, multipv: int):
+    depth = int(tokens[tokens.index("depth") + 1]) if "depth" in tokens else 10
+    start = time.perf_counter()
+    time.sleep(depth * MS_PER_DEPTH / 1000)
+    elapsed_ms = max(1, int((time.perf_counter() - start) * 1000))
+    nodes = depth * 50000
+
+    moves = sorted(board.legal_moves, key=lambda m: m.uci())
+    if not moves:
+        score = "mate 0" if board.is_checkmate() else "cp 0"
+        print(f"info depth {depth} score {score} nodes 0 time {elapsed_ms}")
+        print("bestmove (none)", flush=True)
+        return
+
+    for index, move in enumerate(moves[:multipv], start=1):
+        print(f"info depth {depth} seldepth {depth} multipv {index} score cp {evaluate(board)} "
+              f"nodes {nodes} nps {nodes * 1000 // elapsed_ms} time {elapsed_ms} pv {move.uci()}")
+    print(f"bestmove {moves[0].uci()}", flush=True)
+
+
+def main():
+    board = chess.Board()
+    multipv = 1
+    for line in sys.stdin:
+        tokens = line.split()
+        if not tokens:
+            continue
+        command = tokens[0]
+        if command == "uci":
+            print("id name FakeUCI")
+            print("id author Chess Review load tests")
+            print("option name MultiPV type spin default 1 min 1 max 500")
+            print("uciok", flush=True)
+        elif command == "isready":
+            print("readyok", flush=True)
+        elif command == "setoption" and line.lower().split()[2:3] == ["multipv"]:
+            multipv = int(tokens[-1])
+        elif command == "position":
+            board = parse_position(tokens[1:])
+        elif command == "go":
+            go(board, tokens[1:], multipv)
+        elif command == "quit":
+            return
+
+
+if __name__ == "__main__":
+    main()
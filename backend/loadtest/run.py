@@ -0,0 +1,230 @@
+"""Load test the API with concurrent virtual users (asyncio + httpx)
+
+Seed synthetic data first (python seed_data.py --synthetic), start the API
+with the fake engine (STOCKFISH_PATH=loadtest/fake_uci_engine.py), then:
+
+    python loadtest/run.py --users 200 --duration 60 --json results.json
+
+Pass --accounts with the number of users seeded if it is not the default
+100000. Each virtual user logs in as a synthetic account and loops over weighted
+scenarios. The report gives throughput and latency percentiles per endpoint.
+Pass --baseline with an earlier --json file to fail on p95 regressions.
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+import chess
+import httpx
+
+LOAD_USER_PREFIX = "loaduser"
+LOAD_USER_PASSWORD = "loadtest"
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.login_failures = 0
+
+    async def call(self, client: httpx.AsyncClient, name: str, method: str, url: str, **kwargs) -> Optional[httpx.Response]:
+        start = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+        except httpx.HTTPError:
+            self.errors[name] += 1
+            return None
+        self.latencies[name].append(time.perf_counter() - start)
+        # 429s from analysis admission control are expected under load; count them separately
+        if response.status_code == 429:
+            self.errors[f"{name} (429)"] += 1
+        elif response.status_code >= 400:
+            self.errors[name] += 1
+        return response
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def review_positions(plies: int = 40) -> List[str]:
+    """FENs of a random game, as the review page would send them"""
+    board = chess.Board()
+    fens = [board.fen()]
+    for _ in range(plies):
+        if board.is_game_over():
+            break
+        board.push(random.choice(list(board.legal_moves)))
+        fens.append(board.fen())
+    return fens
+
+
+# --- SCENARIOS ---
+async def scenario_auth(client, rec, state):
+    name = f"load{random.getrandbits(48):x}"
+    await rec.call(client, "POST /register", "POST", "/register",
+                   json={"username": name, "email": f"{name}@example.com", "password": LOAD_USER_PASSWORD})
+    await rec.call(client, "POST /token", "POST", "/token",
+                   data={"username": name, "password": LOAD_USER_PASSWORD})
+
+
+async def scenario_leaderboard(client, rec, state):
+    tc = random.choice(["bullet", "blitz", "rapid", "classical"])
+    for page in range(1, random.randint(2, 4)):
+        await rec.call(client, "GET /leaderboard/{tc}", "GET", f"/leaderboard/{tc}", params={"page": page})
+
+
+async def scenario_puzzle(client, rec, state):
+    response = await rec.call(client, "GET /puzzles/daily", "GET", "/puzzles/daily")
+    if response is not None and response.status_code == 200:
+        await rec.call(client, "POST /puzzles/attempt", "POST", "/puzzles/attempt", headers=state["auth"],
+                       json={"puzzle_id": response.json()["id"], "solved": random.random() < 0.6,
+                             "time_taken_seconds": random.randint(5, 120)})
+
+
+async def scenario_my_games(client, rec, state):
+    for offset in range(0, 20 * random.randint(1, 5), 20):
+        await rec.call(client, "GET /games/my-games", "GET", "/games/my-games", headers=state["auth"],
+                       params={"limit": 20, "offset": offset})
+
+
+async def scenario_review(client, rec, state):
+    await rec.call(client, "POST /analyze-batch", "POST", "/analyze-batch", headers=state["auth"],
+                   json={"fens": review_positions(), "depth": state["depth"]}, timeout=300)
+
+
+SCENARIOS = {
+    "auth": (scenario_auth, 1),
+    "leaderboard": (scenario_leaderboard, 4),
+    "puzzle": (scenario_puzzle, 3),
+    "my_games": (scenario_my_games, 3),
+    "review": (scenario_review, 1),
+}
+
+
+async def virtual_user(index: int, args, rec: Recorder, deadline: float, scenarios):
+    async with httpx.AsyncClient(base_url=args.url, timeout=30) as client:
+        username = f"{LOAD_USER_PREFIX}{index % args.accounts}"
+        response = await rec.call(client, "POST /token", "POST", "/token",
+                                  data={"username": username, "password": LOAD_USER_PASSWORD})
+        if response is None or response.status_code != 200:
+            rec.login_failures += 1
+            return
+        state = {
+            "auth": {"Authorization": f"Bearer {response.json()['access_token']}"},
+            "depth": args.depth,
+        }
+        names = list(scenarios)
+        weights = [scenarios[n][1] for n in names]
+        while time.monotonic() < deadline:
+            scenario = scenarios[random.choices(names, weights)[0]][0]
+            await scenario(client, rec, state)
+            if args.think_time:
+                await asyncio.sleep(random.expovariate(1 / args.think_time))
+
+
+def summarize(rec: Recorder, elapsed: float) -> dict:
+    endpoints = {}
+    for name, values in sorted(rec.latencies.items()):
+        values.sort()
+        endpoints[name] = {
+            "requests": len(values),
+            "rps": len(values) / elapsed,
+            "p50_ms": percentile(values, 50) * 1000,
+            "p90_ms": percentile(values, 90) * 1000,
+            "p95_ms": percentile(values, 95) * 1000,
+            "p99_ms": percentile(values, 99) * 1000,
+            "max_ms": values[-1] * 1000,
+        }
+    total = sum(len(v) for v in rec.latencies.values())
+    return {
+        "duration_seconds": elapsed,
+        "total_requests": total,
+        "total_rps": total / elapsed,
+        "errors": dict(rec.errors),
+        "login_failures": rec.login_failures,
+        "endpoints": endpoints,
+    }
+
+
+def print_report(summary: dict):
+    print(f"\n{'endpoint':<28}{'reqs':>8}{'rps':>9}{'p50':>9}{'p90':>9}{'p95':>9}{'p99':>9}{'max':>9}  (ms)")
+    for name, e in summary["endpoints"].items():
+        print(f"{name:<28}{e['requests']:>8}{e['rps']:>9.1f}{e['p50_ms']:>9.1f}{e['p90_ms']:>9.1f}"
+              f"{e['p95_ms']:>9.1f}{e['p99_ms']:>9.1f}{e['max_ms']:>9.1f}")
+    print(f"\nTotal: {summary['total_requests']} requests, {summary['total_rps']:.1f} req/s "
+          f"over {summary['duration_seconds']:.1f}s")
+    if summary["errors"]:
+        print("Errors:", ", ".join(f"{k}: {v}" for k, v in summary["errors"].items()))
+    if summary["login_failures"]:
+        print(f"WARNING: {summary['login_failures']} virtual users could not log in and did no work; "
+              f"does --accounts match the number of users seeded?")
+
+
+def compare(summary: dict, baseline_path: str, tolerance: float) -> List[str]:
+    """Endpoints whose p95 got worse than the baseline by more than `tolerance`"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    regressions = []
+    for name, e in summary["endpoints"].items():
+        old = baseline["endpoints"].get(name)
+        if old and old["p95_ms"] > 0 and e["p95_ms"] > old["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {old['p95_ms']:.1f}ms -> {e['p95_ms']:.1f}ms")
+    return regressions
+
+
+async def run(args) -> dict:
+    scenarios = {n: SCENARIOS[n] for n in args.scenarios}
+    rec = Recorder()
+    start = time.monotonic()
+    deadline = start + args.duration
+    users = []
+    for i in range(args.users):
+        users.append(asyncio.create_task(virtual_user(i, args, rec, deadline, scenarios)))
+        # Ramp up gradually so logins (bcrypt) are not all at t=0
+        if args.ramp_up:
+            await asyncio.sleep(args.ramp_up / args.users)
+    await asyncio.gather(*users)
+    return summarize(rec, time.monotonic() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the Chess Review API")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--users", type=int, default=50, help="concurrent virtual users")
+    parser.add_argument("--accounts", type=int, default=100000,
+                        help="synthetic accounts to log in as; must match seed_data.py --synthetic --users")
+    parser.add_argument("--duration", type=float, default=60.0, help="seconds")
+    parser.add_argument("--ramp-up", type=float, default=10.0, help="seconds to start all users")
+    parser.add_argument("--think-time", type=float, default=1.0, help="mean pause between scenarios")
+    parser.add_argument("--depth", type=int, default=10, help="analysis depth for reviews")
+    parser.add_argument("--scenarios", nargs="+", default=list(SCENARIOS), choices=list(SCENARIOS))
+    parser.add_argument("--json", help="write the summary to this file")
+    parser.add_argument("--baseline", help="summary from an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed p95 regression (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    summary = asyncio.run(run(args))
+    print_report(summary)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+    if args.baseline:
+        regressions = compare(summary, args.baseline, args.tolerance)
+        if regressions:
+            print("\nRegressions:\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+        print("\nNo p95 regressions against baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,315 @@
+"""Mine puzzles from stored games
+
+Scans finished games for blunders (sharp eval swings), verifies that the
+punishing line is unique with a deeper search, tags themes, assigns an
+initial rating and bulk-inserts the results into the puzzles table.
+
+Games are processed in id-ordered chunks across a process pool, one Stockfish
+per process. A checkpoint file records the last fully processed game id so an
+interrupted run resumes where it stopped:
+
+    python mine_puzzles.py --workers 8 --checkpoint mining.json
+"""
+import argparse
+import io
+import json
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.util import Finalize
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import chess
+import chess.engine
+import chess.pgn
+
+from app.analysis import engine_manager
+from app.cache import invalidate_puzzles
+from app.database import SessionLocal, init_db, Game, GameResult, Puzzle
+
+# A move counts as a blunder if it costs at least this much and leaves the mover worse off
+BLUNDER_SWING_CP = 200
+BLUNDER_RESULT_CP = -150
+
+# The solution must win clearly, and the second-best move must be clearly worse
+WINNING_CP = 300
+UNIQUE_GAP_CP = 200
+MAX_SOLUTION_MOVES = 3
+
+MATE_SCORE = 100000
+PIECE_VALUES = {chess.PAWN: 1, chess.KNIGHT: 3, chess.BISHOP: 3, chess.ROOK: 5, chess.QUEEN: 9, chess.KING: 0}
+
+# One engine per worker process, started by the pool initializer
+_engine: Optional[chess.engine.SimpleEngine] = None
+
+
+def _start_engine(path: str):
+    global _engine
+    _engine = chess.engine.SimpleEngine.popen_uci(path)
+    # Pool workers skip atexit; a multiprocessing finalizer runs before the
+    # process waits on the engine's non-daemon thread
+    Finalize(_engine, _engine.quit, exitpriority=10)
+
+
+def _cp(score: chess.engine.PovScore, color: chess.Color) -> int:
+    return score.pov(color).score(mate_score=MATE_SCORE)
+
+
+def find_blunders(board: chess.Board, moves: List[chess.Move], depth: int) -> Iterator[chess.Board]:
+    """Yield positions right after a blunder, with the punishing side to move"""
+    previous = _cp(_engine.analyse(board, chess.engine.Limit(depth=depth))["score"], board.turn)
+    for move in moves:
+        board.push(move)
+        if board.is_game_over():
+            return
+        # The eval of the new position from the opponent's side is minus the mover's eval
+        after = -_cp(_engine.analyse(board, chess.engine.Limit(depth=depth))["score"], board.turn)
+        if previous - after >= BLUNDER_SWING_CP and after <= BLUNDER_RESULT_CP:
+            yield board.copy()
+        previous = -after
+
+
+def unique_best_move(board: chess.Board, depth: int) -> Optional[Tuple[chess.Move, int]]:
+    """The single winning move in this position, or None if there isn't exactly one"""
+    infos = _engine.analyse(board, chess.engine.Limit(depth=depth), multipv=2)
+    if not infos or "pv" not in infos[0]:
+        return None
+    best = _cp(infos[0]["score"], board.turn)
+    if best < WINNING_CP:
+        return None
+    if len(infos) > 1:
+        second = _cp(infos[1]["score"], board.turn)
+        if best - second < UNIQUE_GAP_CP or second >= WINNING_CP:
+            return None
+    return infos[0]["pv"][0], best
+
+
+def solve(board: chess.Board, depth: int) -> Optional[Tuple[List[chess.Move], int]]:
+    """Follow the winning line while every solver move stays unique"""
+    board = board.copy()
+    line: List[chess.Move] = []
+    first_eval = None
+    for _ in range(MAX_SOLUTION_MOVES):
+        found = unique_best_move(board, depth)
+        if found is None:
+            break
+        move, score = found
+        first_eval = score if first_eval is None else first_eval
+        line.append(move)
+        board.push(move)
+        if board.is_game_over():
+            break
+        reply = _engine.analyse(board, chess.engine.Limit(depth=depth)).get("pv")
+        if not reply:
+            break
+        line.append(reply[0])
+        board.push(reply[0])
+    # Drop a trailing opponent reply so the puzzle ends on the solver's move
+    if len(line) % 2 == 0:
+        line = line[:-1]
+    if not line:
+        return None
+    return line, first_eval
+
+
+def tag_themes(board: chess.Board, line: List[chess.Move], score: int) -> List[str]:
+    themes = []
+    solver = board.turn
+    first = line[0]
+
+    end = board.copy()
+    for move in line:
+        end.push(move)
+    if end.is_checkmate():
+        themes.append("mate")
+        themes.append(f"mateIn{(len(line) + 1) // 2}")
+    elif score >= 600:
+        themes.append("crushing")
+    else:
+        themes.append("advantage")
+
+    if first.promotion:
+        themes.append("promotion")
+
+    after = board.copy()
+    after.push(first)
+    attacked = [
+        sq for sq in after.attacks(first.to_square)
+        if after.color_at(sq) == (not solver)
+        and (after.piece_type_at(sq) == chess.KING or PIECE_VALUES[after.piece_type_at(sq)] >= 3)
+    ]
+    if len(attacked) >= 2:
+        themes.append("fork")
+
+    pinned_before = {sq for sq in chess.SQUARES if board.color_at(sq) == (not solver) and board.is_pinned(not solver, sq)}
+    pinned_after = {sq for sq in chess.SQUARES if after.color_at(sq) == (not solver) and after.is_pinned(not solver, sq)}
+    if pinned_after - pinned_before:
+        themes.append("pin")
+
+    moved = board.piece_type_at(first.from_square)
+    captured = board.piece_type_at(first.to_square)
+    if after.is_attacked_by(not solver, first.to_square) and PIECE_VALUES[moved] > PIECE_VALUES.get(captured, 0) + 1:
+        themes.append("sacrifice")
+
+    pieces = len(board.piece_map())
+    themes.append("opening" if board.fullmove_number <= 12 else "endgame" if pieces <= 12 else "middlegame")
+    return themes
+
+
+def initial_rating(board: chess.Board, line: List[chess.Move], themes: List[str], base: int) -> int:
+    """Starting rating from the players' strength and how hard the line looks"""
+    rating = base + 100 * (len(line) // 2)
+    first = line[0]
+    if board.gives_check(first) or board.is_capture(first):
+        rating -= 150
+    else:
+        rating += 150
+    if "sacrifice" in themes:
+        rating += 200
+    return max(600, min(2800, rating))
+
+
+def mine_game(game_row: Tuple[int, str, Optional[int], Optional[int]], scan_depth: int, verify_depth: int) -> List[Dict]:
+    game_id, pgn, white_rating, black_rating = game_row
+    parsed = chess.pgn.read_game(io.StringIO(pgn))
+    if parsed is None:
+        return []
+    ratings = [r for r in (white_rating, black_rating) if r]
+    base = sum(ratings) // len(ratings) if ratings else 1500
+
+    puzzles = []
+    for position in find_blunders(parsed.board(), list(parsed.mainline_moves()), scan_depth):
+        solved = solve(position, verify_depth)
+        if solved is None:
+            continue
+        line, score = solved
+        themes = tag_themes(position, line, score)
+        puzzles.append({
+            "fen": position.fen(),
+            "moves": ",".join(m.uci() for m in line),
+            "rating": initial_rating(position, line, themes, base),
+            "themes": ",".join(themes),
+        })
+    return puzzles
+
+
+def mine_chunk(args) -> Tuple[int, List[Dict]]:
+    """Worker entry point: mine a chunk of games, return (last game id, puzzles)"""
+    rows, scan_depth, verify_depth = args
+    puzzles = []
+    for row in rows:
+        try:
+            puzzles.extend(mine_game(row, scan_depth, verify_depth))
+        except chess.engine.EngineTerminatedError:
+            # A dead engine would "skip" every remaining game; fail the chunk so the checkpoint stays put
+            raise
+        except (chess.engine.EngineError, ValueError) as e:
+            print(f"Skipping game {row[0]}: {e}")
+    return rows[-1][0], puzzles
+
+
+def iter_chunks(after_id: int, chunk_size: int, limit: Optional[int]) -> Iterator[list]:
+    """Finished games with a PGN, in id order, starting after the checkpoint"""
+    fetched = 0
+    db = SessionLocal()
+    try:
+        while limit is None or fetched < limit:
+            size = chunk_size if limit is None else min(chunk_size, limit - fetched)
+            rows = (
+                db.query(Game.id, Game.pgn, Game.white_rating_before, Game.black_rating_before)
+                .filter(Game.id > after_id, Game.pgn.isnot(None), Game.result.notin_([GameResult.ONGOING, GameResult.ABORTED]))
+                .order_by(Game.id)
+                .limit(size)
+                .all()
+            )
+            if not rows:
+                return
+            fetched += len(rows)
+            after_id = rows[-1][0]
+            yield [tuple(r) for r in rows]
+    finally:
+        db.close()
+
+
+def ordered_results(pool: ProcessPoolExecutor, func, items: Iterator, window: int) -> Iterator:
+    """Like pool.map, but keeps at most `window` chunks in flight instead of loading every game up front"""
+    pending = deque()
+    for item in items:
+        pending.append(pool.submit(func, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def store_puzzles(puzzles: List[Dict]) -> int:
+    """Bulk insert puzzles, skipping positions already in the table"""
+    if not puzzles:
+        return 0
+    db = SessionLocal()
+    try:
+        fens = {p["fen"] for p in puzzles}
+        existing = {fen for (fen,) in db.query(Puzzle.fen).filter(Puzzle.fen.in_(fens))}
+        new, seen = [], set(existing)
+        for puzzle in puzzles:
+            if puzzle["fen"] not in seen:
+                seen.add(puzzle["fen"])
+                new.append({**puzzle, "popularity": 0, "is_daily": False})
+        db.bulk_insert_mappings(Puzzle, new)
+        db.commit()
+        return len(new)
+    finally:
+        db.close()
+
+
+def load_checkpoint(path: str) -> int:
+    if not os.path.exists(path):
+        return 0
+    with open(path) as f:
+        return json.load(f).get("last_game_id", 0)
+
+
+def save_checkpoint(path: str, last_game_id: int):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump({"last_game_id": last_game_id}, f)
+    os.replace(tmp, path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--chunk-size", type=int, default=50, help="games per work unit")
+    parser.add_argument("--scan-depth", type=int, default=12, help="depth for the blunder scan")
+    parser.add_argument("--verify-depth", type=int, default=18, help="depth for solution checks")
+    parser.add_argument("--checkpoint", default="puzzle_mining.json")
+    parser.add_argument("--limit", type=int, default=None, help="stop after this many games")
+    args = parser.parse_args()
+
+    init_db()
+    if not engine_manager.validate():
+        print(f"Engine check failed: {engine_manager.error}")
+        raise SystemExit(1)
+
+    last_id = load_checkpoint(args.checkpoint)
+    print(f"Resuming after game {last_id}" if last_id else "Starting from the first game")
+
+    chunks = ((rows, args.scan_depth, args.verify_depth) for rows in iter_chunks(last_id, args.chunk_size, args.limit))
+    total = 0
+    with ProcessPoolExecutor(
+        max_workers=args.workers, initializer=_start_engine, initargs=(engine_manager.path,)
+    ) as pool:
+        # Results come back in submission order, so the checkpoint only ever moves past finished chunks
+        for chunk_last_id, puzzles in ordered_results(pool, mine_chunk, chunks, args.workers * 2):
+            total += store_puzzles(puzzles)
+            save_checkpoint(args.checkpoint, chunk_last_id)
+            print(f"Processed games up to {chunk_last_id}: {total} puzzles added")
+
+    # Only reaches a running API through a shared (Redis) cache; with the in-memory
+    # backend the API picks the new puzzles up when its cached entries expire
+    invalidate_puzzles()
+    print(f"\nPuzzle mining complete! Added {total} puzzles")
+
+
+if __name__ == "__main__":
+    main()
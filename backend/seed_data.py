@@ -1,8 +1,21 @@
 """Seed database with initial data"""
+import argparse
+import random
 import sys
-from datetime import date
-from app.database import SessionLocal, init_db, Puzzle, User, UserProfile
+import time
+from datetime import date, datetime, timedelta
+import chess
+import chess.pgn
+from app.database import (
+    SessionLocal, init_db, Puzzle, User, UserProfile, Game, GameResult, TimeControl
+)
 from app.auth import get_password_hash
+from app.cache import invalidate_puzzles
+
+# Synthetic load-test accounts are loaduser0..loaduserN, all with this password
+LOAD_USER_PREFIX = "loaduser"
+LOAD_USER_PASSWORD = "loadtest"
+INSERT_BATCH_SIZE = 10000
 
 def seed_puzzles():
     """Add sample puzzles to the database"""
@@ -45,6 +58,8 @@ def seed_puzzles():
         db.add(puzzle)
     
     db.commit()
+    # Reaches a running API only through a shared (Redis) cache, see invalidate_puzzles()
+    invalidate_puzzles()
     print(f"Added {len(sample_puzzles)} puzzles to database")
     db.close()
 
@@ -84,7 +99,117 @@ def seed_test_user():
     print(f"Created test user: testuser / password123")
     db.close()
 
+def _random_games(rng: random.Random, count: int, plies: int = 60):
+    """A small pool of random legal games; synthetic rows reuse these PGNs"""
+    games = []
+    for _ in range(count):
+        board = chess.Board()
+        for _ in range(rng.randint(20, plies)):
+            if board.is_game_over():
+                break
+            board.push(rng.choice(list(board.legal_moves)))
+        games.append(board)
+    return games
+
+
+def _insert_in_batches(db, table, rows):
+    for start in range(0, len(rows), INSERT_BATCH_SIZE):
+        db.execute(table.insert(), rows[start:start + INSERT_BATCH_SIZE])
+    db.commit()
+
+
+def seed_synthetic(num_users: int, num_games: int, seed: int = 42):
+    """Bulk-load synthetic users, games and puzzles for load testing"""
+    db = SessionLocal()
+    if db.query(User).filter(User.username == f"{LOAD_USER_PREFIX}0").first():
+        print("Synthetic data already exists. Skipping.")
+        db.close()
+        return
+
+    rng = random.Random(seed)
+    started = time.time()
+    now = datetime.utcnow()
+
+    # bcrypt is deliberately slow, so every synthetic user shares one hash
+    hashed = get_password_hash(LOAD_USER_PASSWORD)
+    _insert_in_batches(db, User.__table__, [
+        {"username": f"{LOAD_USER_PREFIX}{i}", "email": f"{LOAD_USER_PREFIX}{i}@example.com",
+         "hashed_password": hashed, "created_at": now}
+        for i in range(num_users)
+    ])
+    user_ids = [uid for (uid,) in db.query(User.id).filter(User.username.like(f"{LOAD_USER_PREFIX}%"))]
+    print(f"Inserted {len(user_ids)} users ({time.time() - started:.1f}s)")
+
+    def rating():
+        return max(400, min(2800, int(rng.gauss(1500, 300))))
+
+    _insert_in_batches(db, UserProfile.__table__, [
+        {"user_id": uid, "rating_bullet": rating(), "rating_blitz": rating(),
+         "rating_rapid": rating(), "rating_classical": rating(), "puzzle_rating": rating(),
+         "total_games": 0, "wins": 0, "losses": 0, "draws": 0,
+         "preferred_time_control": TimeControl.BLITZ.name, "board_theme": "default",
+         "piece_style": "standard", "sound_enabled": True}
+        for uid in user_ids
+    ])
+    print(f"Inserted {len(user_ids)} profiles ({time.time() - started:.1f}s)")
+
+    boards = _random_games(rng, 200)
+    pgns = [str(chess.pgn.Game.from_board(b)) for b in boards]
+    clocks = {TimeControl.BULLET: 60, TimeControl.BLITZ: 300, TimeControl.RAPID: 600, TimeControl.CLASSICAL: 1800}
+    results = [GameResult.WHITE_WIN, GameResult.BLACK_WIN, GameResult.DRAW]
+    time_controls = list(TimeControl)
+
+    inserted = 0
+    while inserted < num_games:
+        rows = []
+        for _ in range(min(INSERT_BATCH_SIZE, num_games - inserted)):
+            white, black = rng.sample(user_ids, 2)
+            tc = rng.choice(time_controls)
+            played = now - timedelta(seconds=rng.randint(0, 365 * 24 * 3600))
+            white_before, black_before = rating(), rating()
+            rows.append({
+                "white_player_id": white, "black_player_id": black,
+                "time_control": tc.name, "time_limit_seconds": clocks[tc], "increment_seconds": 0,
+                "result": rng.choice(results).name, "pgn": rng.choice(pgns),
+                "is_rated": True, "is_vs_engine": False,
+                "created_at": played, "completed_at": played + timedelta(seconds=clocks[tc]),
+                "white_rating_before": white_before, "white_rating_after": white_before + rng.randint(-16, 16),
+                "black_rating_before": black_before, "black_rating_after": black_before + rng.randint(-16, 16),
+            })
+        db.execute(Game.__table__.insert(), rows)
+        db.commit()
+        inserted += len(rows)
+        print(f"Inserted {inserted}/{num_games} games ({time.time() - started:.1f}s)")
+
+    puzzle_rows = []
+    for board in boards:
+        moves = board.move_stack
+        if len(moves) < 12:
+            continue
+        position = chess.Board()
+        for move in moves[:10]:
+            position.push(move)
+        puzzle_rows.append({
+            "fen": position.fen(), "moves": ",".join(m.uci() for m in moves[10:12]),
+            "rating": rating(), "themes": "synthetic", "popularity": 0, "is_daily": False,
+        })
+    _insert_in_batches(db, Puzzle.__table__, puzzle_rows)
+    invalidate_puzzles()
+    print(f"Inserted {len(puzzle_rows)} puzzles")
+
+    db.close()
+    print(f"Synthetic data ready in {time.time() - started:.1f}s "
+          f"(log in as {LOAD_USER_PREFIX}<n> / {LOAD_USER_PASSWORD})")
+
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Seed the database")
+    parser.add_argument("--synthetic", action="store_true", help="also load synthetic data for load testing")
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--games", type=int, default=1000000)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
     print("Initializing database...")
     init_db()
     
@@ -94,4 +219,8 @@ if __name__ == "__main__":
     print("\nSeeding test user...")
     seed_test_user()
     
+    if args.synthetic:
+        print("\nSeeding synthetic load-test data...")
+        seed_synthetic(args.users, args.games, args.seed)
+    
     print("\nDatabase seeding complete!")